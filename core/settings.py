@@ -153,6 +153,33 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Uploaded and generated files (background import/export jobs)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = db_dir / 'media'
+
+# Worker threads per process for background import/export jobs
+TAREAS_MAX_WORKERS = int(os.environ.get('TAREAS_MAX_WORKERS', '2'))
+# Seconds without progress after which a pending or running job is marked as failed
+TAREAS_TIMEOUT = int(os.environ.get('TAREAS_TIMEOUT', '3600'))
+
+# Cache for reports, barcode lookups and job progress. It must be shared by
+# every worker process, since writes invalidate it through version stamps
+# stored in it. Defaults to files next to the database (one host); set
+# CACHE_URL for Redis or another location:
+#   redis://localhost:6379/0  (needs the redis package; any Redis-compatible server)
+#   file:///var/tmp/inventario-cache
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+else:
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_URL[len('file://'):] if CACHE_URL.startswith('file://') else db_dir / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }}
+# Progress of running jobs, read by polls that any worker may serve
+CACHES['tareas'] = CACHES['default']
+
 if not DEBUG:
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
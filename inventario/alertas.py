@@ -0,0 +1,162 @@
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Case, CharField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import AlertaStock, SaldoInventario, UmbralStock
+
+# Levels used by the Alto/Medio/Bajo estado for materials without a threshold
+MINIMO_POR_DEFECTO = 20
+REORDEN_POR_DEFECTO = 100
+
+
+def thresholds_for(material_ids):
+    """{(material_id, bodega_id or None): (minimo, reorden)} for the given materials, in one query."""
+    return {
+        (material_id, bodega_id): (minimo, reorden)
+        for material_id, bodega_id, minimo, reorden in UmbralStock.objects.filter(
+            material_id__in=material_ids
+        ).values_list('material_id', 'bodega_id', 'minimo', 'reorden')
+    }
+
+
+def resolve_threshold(umbrales, material_id, bodega_id):
+    """The bodega-specific threshold if any, else the material's general one, else None."""
+    return umbrales.get((material_id, bodega_id)) or umbrales.get((material_id, None))
+
+
+def stock_estado(cantidad, umbral=None):
+    # Kept in step with estado_expression
+    minimo, reorden = umbral or (MINIMO_POR_DEFECTO, REORDEN_POR_DEFECTO)
+    if cantidad > reorden:
+        return 'Alto'
+    elif cantidad > minimo:
+        return 'Medio'
+    else:
+        return 'Bajo'
+
+
+def threshold_annotations():
+    """
+    minimo / reorden annotations for querysets with material and bodega columns,
+    resolved like resolve_threshold (bodega-specific, then general, then default).
+    """
+    especifico = UmbralStock.objects.filter(material_id=OuterRef('material_id'), bodega_id=OuterRef('bodega_id'))
+    general = UmbralStock.objects.filter(material_id=OuterRef('material_id'), bodega__isnull=True)
+    return {
+        campo: Coalesce(
+            Subquery(especifico.values(campo)[:1]), Subquery(general.values(campo)[:1]), Value(defecto)
+        )
+        for campo, defecto in (('minimo', MINIMO_POR_DEFECTO), ('reorden', REORDEN_POR_DEFECTO))
+    }
+
+
+def estado_expression(cantidad='cantidad'):
+    """stock_estado as SQL, over the minimo / reorden of threshold_annotations."""
+    return Case(
+        When(**{f"{cantidad}__gt": F('reorden')}, then=Value('Alto')),
+        When(**{f"{cantidad}__gt": F('minimo')}, then=Value('Medio')),
+        default=Value('Bajo'),
+        output_field=CharField()
+    )
+
+
+def alert_level(cantidad, umbral):
+    minimo, _ = umbral
+    return 'minimo' if cantidad <= minimo else 'reorden'
+
+
+def evaluate_alerts(keys):
+    """
+    Re-evaluates the alerts of the given (material_id, bodega_id) pairs against
+    their current stock in the bodega. Only pairs with a configured threshold
+    are looked at, so writes on materials without thresholds cost one query.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    umbrales = thresholds_for({material_id for material_id, _ in keys})
+    keys = {key for key in keys if resolve_threshold(umbrales, *key)}
+    if not keys:
+        return
+
+    condition = reduce(or_, (Q(material_id=m, bodega_id=b) for m, b in keys))
+    totals = {
+        (m, b): cantidad or 0
+        for m, b, cantidad in SaldoInventario.objects.filter(condition)
+        .values('material_id', 'bodega_id').annotate(total=Sum('cantidad'))
+        .values_list('material_id', 'bodega_id', 'total')
+    }
+
+    with transaction.atomic():
+        alertas = {(a.material_id, a.bodega_id): a for a in AlertaStock.objects.filter(condition)}
+        for material_id, bodega_id in keys:
+            minimo, reorden = resolve_threshold(umbrales, material_id, bodega_id)
+            cantidad = totals.get((material_id, bodega_id), 0)
+            alerta = alertas.get((material_id, bodega_id))
+            if cantidad > reorden:
+                if alerta is not None:
+                    alerta.delete()
+                continue
+
+            nivel = alert_level(cantidad, (minimo, reorden))
+            if alerta is None:
+                # Another writer may raise the same alert concurrently: keep its row and set the values
+                AlertaStock.objects.bulk_create(
+                    [AlertaStock(
+                        material_id=material_id, bodega_id=bodega_id, nivel=nivel,
+                        cantidad=cantidad, minimo=minimo, reorden=reorden
+                    )],
+                    ignore_conflicts=True
+                )
+                AlertaStock.objects.filter(material_id=material_id, bodega_id=bodega_id).update(
+                    nivel=nivel, cantidad=cantidad, minimo=minimo, reorden=reorden, actualizado=timezone.now()
+                )
+            elif (alerta.nivel, alerta.cantidad, alerta.minimo, alerta.reorden) != (nivel, cantidad, minimo, reorden):
+                alerta.nivel, alerta.cantidad, alerta.minimo, alerta.reorden = nivel, cantidad, minimo, reorden
+                alerta.save(update_fields=['nivel', 'cantidad', 'minimo', 'reorden', 'actualizado'])
+
+
+def evaluate_material_alerts(material_id):
+    """Re-evaluates a material in every bodega where it has stock or a threshold (after threshold changes)."""
+    umbrales = thresholds_for([material_id])
+    bodegas = set(SaldoInventario.objects.filter(material_id=material_id).values_list('bodega_id', flat=True))
+    bodegas |= {bodega_id for _, bodega_id in umbrales if bodega_id is not None}
+    con_umbral = {bodega_id for bodega_id in bodegas if resolve_threshold(umbrales, material_id, bodega_id)}
+    AlertaStock.objects.filter(material_id=material_id).exclude(bodega_id__in=con_umbral).delete()
+    evaluate_alerts({(material_id, bodega_id) for bodega_id in con_umbral})
+
+
+def rebuild_alerts():
+    """Recomputes every alert from the balances in one pass, keeping the desde of alerts that persist."""
+    umbrales = thresholds_for(UmbralStock.objects.values('material_id'))
+    totals = {
+        (m, b): cantidad or 0
+        for m, b, cantidad in SaldoInventario.objects.filter(material_id__in={m for m, _ in umbrales})
+        .values('material_id', 'bodega_id').annotate(total=Sum('cantidad'))
+        .values_list('material_id', 'bodega_id', 'total')
+    }
+    for material_id, bodega_id in umbrales:
+        if bodega_id is not None:
+            totals.setdefault((material_id, bodega_id), 0)
+
+    with transaction.atomic():
+        desde = {
+            (m, b): fecha for m, b, fecha in AlertaStock.objects.values_list('material_id', 'bodega_id', 'desde')
+        }
+        alertas = []
+        for (material_id, bodega_id), cantidad in totals.items():
+            umbral = resolve_threshold(umbrales, material_id, bodega_id)
+            if umbral is None or cantidad > umbral[1]:
+                continue
+            alerta = AlertaStock(
+                material_id=material_id, bodega_id=bodega_id, nivel=alert_level(cantidad, umbral),
+                cantidad=cantidad, minimo=umbral[0], reorden=umbral[1]
+            )
+            if (material_id, bodega_id) in desde:
+                alerta.desde = desde[(material_id, bodega_id)]
+            alertas.append(alerta)
+        AlertaStock.objects.all().delete()
+        AlertaStock.objects.bulk_create(alertas, batch_size=1000)
+    return len(alertas)
@@ -0,0 +1,151 @@
+import time
+from functools import lru_cache
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from .models import Material
+
+SEARCH_FIELDS = ['codigo', 'codigo_barras', 'referencia', 'nombre']
+FTS_TABLE = 'inventario_material_fts'
+
+# --- Search index -----------------------------------------------------------
+# SQLite: an FTS5 table with the trigram tokenizer, kept in sync by triggers
+# (so bulk writes from the Excel import are indexed too).
+# PostgreSQL: pg_trgm GIN indexes on UPPER(col), which is what icontains and
+# istartswith compare against.
+
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES (new.id, new.codigo, new.codigo_barras, new.referencia, new.nombre);
+        END""",
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES ('delete', old.id, old.codigo, old.codigo_barras, old.referencia, old.nombre);
+        END""",
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES ('delete', old.id, old.codigo, old.codigo_barras, old.referencia, old.nombre);
+            INSERT INTO {FTS_TABLE}(rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES (new.id, new.codigo, new.codigo_barras, new.referencia, new.nombre);
+        END""",
+}
+
+
+def ensure_search_index(conn=connection):
+    """
+    Creates the backend-specific search index if missing. Idempotent: it also
+    runs after every migrate, because SQLite drops the triggers whenever a
+    migration rebuilds the inventario_material table.
+    """
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                    codigo, codigo_barras, referencia, nombre,
+                    content='inventario_material', content_rowid='id', tokenize='trigram'
+                )""")
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'inventario_material'")
+            existing = {row[0] for row in cursor.fetchall()}
+            if not set(SQLITE_TRIGGERS) <= existing:
+                for sql in SQLITE_TRIGGERS.values():
+                    cursor.execute(sql)
+                # Writes made while the triggers were missing are not indexed
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif conn.vendor == 'postgresql':
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for field in SEARCH_FIELDS:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS material_{field}_trgm_idx "
+                    f"ON inventario_material USING gin (UPPER({field}) gin_trgm_ops)"
+                )
+    _fts_available.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _fts_available():
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+def search_condition(q, prefix=''):
+    """
+    Q for materials containing q in codigo, codigo_barras, referencia or nombre.
+    prefix reaches the material from another model, e.g. 'material__'.
+    """
+    q = q.strip()
+    if _fts_available() and len(q) >= 3:
+        # Trigram phrase query: a case-insensitive substring match served by the index
+        phrase = '"' + q.replace('"', '""') + '"'
+        return Q(**{f"{prefix}id__in": RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [phrase])})
+
+    contains = Q()
+    for field in SEARCH_FIELDS:
+        contains |= Q(**{f"{prefix}{field}__icontains": q})
+    return contains
+
+
+def search_materials(q, limit=20):
+    """
+    Materials matching q in codigo, codigo_barras, referencia or nombre, ranked
+    exact match first, then prefix, then substring (ties by codigo).
+    """
+    q = q.strip()
+    queryset = Material.objects.select_related('marca').filter(search_condition(q))
+
+    exact, prefix = Q(), Q()
+    for field in SEARCH_FIELDS:
+        exact |= Q(**{f"{field}__iexact": q})
+        prefix |= Q(**{f"{field}__istartswith": q})
+    return queryset.annotate(
+        rango=Case(
+            When(exact, then=Value(0)),
+            When(prefix, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField()
+        )
+    ).order_by('rango', 'codigo')[:limit]
+
+
+# --- Barcode lookup cache ---------------------------------------------------
+# Scans resolve through the Django cache, shared by the worker processes (see
+# CACHES in settings). Material writes drop their keys; bulk writes and Marca
+# changes (marca_nombre is cached too) bump a version that retires every key.
+
+BARCODE_CACHE_TIMEOUT = 60 * 5
+_NOT_FOUND = '__no_existe__'
+
+
+def _barcode_version():
+    # A timestamp rather than a counter, so a version key lost to eviction
+    # can never come back with a value that old keys still use
+    return cache.get_or_set('material-barcode:version', time.time_ns, timeout=None)
+
+
+def _barcode_key(codigo_barras):
+    return f"material-barcode:{_barcode_version()}:{codigo_barras}"
+
+
+def lookup_barcode(codigo_barras, serialize):
+    """
+    Cached data of the material with this barcode, or None. serialize turns the
+    Material into the cached representation on a miss.
+    """
+    key = _barcode_key(codigo_barras)
+    data = cache.get(key)
+    if data is None:
+        material = Material.objects.select_related('marca').filter(codigo_barras=codigo_barras).first()
+        data = serialize(material) if material else _NOT_FOUND
+        cache.set(key, data, timeout=BARCODE_CACHE_TIMEOUT)
+    return None if data == _NOT_FOUND else data
+
+
+def invalidate_barcodes(*codigos_barras):
+    cache.delete_many([_barcode_key(codigo) for codigo in codigos_barras if codigo])
+
+
+def invalidate_all_barcodes():
+    cache.set('material-barcode:version', time.time_ns(), timeout=None)
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import AsientoStock, CierreInventario, SaldoCierre, SaldoInventario
+from .stock import aggregate_stock
+
+# A closing holds the stock of every location counting the movements with
+# fecha < cierre.fecha. Stock at any other instant starts from the closest base
+# (a closing, the live balances or the empty history) and only aggregates the
+# ledger entries between that base and the instant, through their fecha index.
+
+# Cut-off of a scheduled closing: the first day of the current period
+PERIODOS_CIERRE = {
+    'dia': lambda hoy: hoy,
+    'semana': lambda hoy: hoy - timedelta(days=hoy.weekday()),
+    'mes': lambda hoy: hoy.replace(day=1),
+}
+
+
+def _closing_stock(cierre, bodega_id=None):
+    saldos = SaldoCierre.objects.filter(cierre=cierre)
+    if bodega_id is not None:
+        saldos = saldos.filter(bodega_id=bodega_id)
+    return saldos.values_list('material_id', 'bodega_id', 'subbodega_id').annotate(total=Sum('cantidad')).order_by()
+
+
+def _live_stock(bodega_id=None):
+    saldos = SaldoInventario.objects.all()
+    if bodega_id is not None:
+        saldos = saldos.filter(bodega_id=bodega_id)
+    return saldos.values_list('material_id', 'bodega_id', 'subbodega_id', 'cantidad')
+
+
+def stock_as_of(hasta, bodega_id=None):
+    """
+    {(material_id, bodega_id, subbodega_id): cantidad} counting the movements with
+    fecha < hasta, optionally limited to one bodega's locations.
+    """
+    cierres = CierreInventario.objects.filter(vigente=True)
+    anterior = cierres.filter(fecha__lte=hasta).order_by('-fecha').first()
+    posterior = cierres.filter(fecha__gt=hasta).order_by('fecha').first()
+
+    # Distance to each base, as a proxy for the number of entries to aggregate
+    if anterior is not None:
+        inicio = anterior.fecha
+    else:
+        inicio = AsientoStock.objects.order_by('fecha').values_list('fecha', flat=True).first() or hasta
+    fin = posterior.fecha if posterior else max(timezone.now(), hasta)
+    inventory = defaultdict(int)
+
+    if hasta - inicio <= fin - hasta:
+        if anterior is not None:
+            for material_id, bodega_id_, subbodega_id, cantidad in _closing_stock(anterior, bodega_id):
+                inventory[(material_id, bodega_id_, subbodega_id)] += cantidad or 0
+            asientos = AsientoStock.objects.filter(fecha__gte=anterior.fecha, fecha__lt=hasta)
+        else:
+            asientos = AsientoStock.objects.filter(fecha__lt=hasta)
+        sign = 1
+    else:
+        if posterior is not None:
+            for material_id, bodega_id_, subbodega_id, cantidad in _closing_stock(posterior, bodega_id):
+                inventory[(material_id, bodega_id_, subbodega_id)] += cantidad or 0
+            asientos = AsientoStock.objects.filter(fecha__gte=hasta, fecha__lt=posterior.fecha)
+        else:
+            for material_id, bodega_id_, subbodega_id, cantidad in _live_stock(bodega_id):
+                inventory[(material_id, bodega_id_, subbodega_id)] += cantidad
+            asientos = AsientoStock.objects.filter(fecha__gte=hasta)
+        sign = -1
+
+    for key, cantidad in aggregate_stock(asientos, bodega_id=bodega_id).items():
+        inventory[key] += sign * cantidad
+    return inventory
+
+
+def _store_closing(cierre):
+    """(Re)computes a closing from the closest other base and marks it vigente. Runs inside a transaction."""
+    # Out of the bases stock_as_of may pick while it is recomputed
+    CierreInventario.objects.filter(pk=cierre.pk).update(vigente=False)
+    saldos = stock_as_of(cierre.fecha)
+    SaldoCierre.objects.filter(cierre=cierre).delete()
+    SaldoCierre.objects.bulk_create(
+        (
+            SaldoCierre(
+                cierre=cierre, material_id=material_id, bodega_id=bodega_id,
+                subbodega_id=subbodega_id, cantidad=cantidad
+            )
+            for (material_id, bodega_id, subbodega_id), cantidad in saldos.items()
+        ),
+        batch_size=1000
+    )
+    cierre.vigente = True
+    cierre.save(update_fields=['vigente', 'actualizado'])
+
+
+def create_closing(fecha, usuario=None):
+    """Stores the stock of every location as of fecha (exclusive) as a closing, recomputing one at the same fecha."""
+    with transaction.atomic():
+        cierre, _ = CierreInventario.objects.select_for_update().get_or_create(
+            fecha=fecha, defaults={'usuario': usuario, 'vigente': False}
+        )
+        _store_closing(cierre)
+    return cierre
+
+
+def refresh_closings():
+    """
+    Recomputes the closings invalidated by movement edits, oldest first, so each
+    one only aggregates the movements since the previous closing. Returns how many.
+    """
+    pks = list(CierreInventario.objects.filter(vigente=False).order_by('fecha').values_list('pk', flat=True))
+    for pk in pks:
+        with transaction.atomic():
+            # The row lock makes a concurrent invalidation wait and apply after this commit
+            cierre = CierreInventario.objects.select_for_update().filter(pk=pk, vigente=False).first()
+            if cierre is not None:
+                _store_closing(cierre)
+    return len(pks)
+
+
+def invalidate_closings(desde):
+    """Marks the closings that count movements at or after desde as stale (call when such a movement changes)."""
+    if desde is not None:
+        CierreInventario.objects.filter(fecha__gt=desde, vigente=True).update(vigente=False)
+
+
+def period_start(periodo, ahora=None):
+    """Local midnight starting the current 'dia', 'semana' or 'mes': the cut-off of a scheduled closing."""
+    hoy = timezone.localdate(ahora)
+    return timezone.make_aware(datetime.combine(PERIODOS_CIERRE[periodo](hoy), time.min))
@@ -0,0 +1,182 @@
+from collections import defaultdict
+from .alertas import estado_expression, resolve_threshold, stock_estado, threshold_annotations, thresholds_for
+from .busqueda import search_condition
+from .models import Bodega, Material, SaldoInventario, Subbodega
+
+# Stock summaries (resumen_inventario, stock_actual): one row per location with
+# stock, filtered, sorted and paginated in SQL from the balances. The same
+# rows can be built in memory from a {(material, bodega, subbodega): cantidad}
+# dict, for stock at a past date.
+
+STOCK_ROW_FIELDS = [
+    'material_id', 'material__codigo', 'material__referencia', 'material__nombre', 'material__unidad',
+    'bodega_id', 'bodega__nombre', 'subbodega_id', 'subbodega__full_path', 'cantidad',
+]
+# ?ordering= values (optionally with a leading '-'), and their row columns
+ORDENAMIENTOS = {
+    'cantidad': 'cantidad',
+    'codigo': 'material__codigo',
+    'nombre': 'material__nombre',
+}
+ESTADOS = ('Alto', 'Medio', 'Bajo')
+# Stable order for ties and for requests without ?ordering=
+_DESEMPATE = ['material__codigo', 'bodega__nombre', 'subbodega__full_path', 'subbodega_id']
+
+
+def _order_by(ordering):
+    if not ordering:
+        return _DESEMPATE
+    campo = ORDENAMIENTOS[ordering.lstrip('-')]
+    return [f"-{campo}" if ordering.startswith('-') else campo] + _DESEMPATE
+
+
+def stock_rows(q=None, bodega_id=None, subbodega=None, estado=None, ordering=None):
+    """
+    Values queryset of STOCK_ROW_FIELDS over the non-zero balances. subbodega
+    (a Subbodega) includes its whole subtree; estado is Alto / Medio / Bajo.
+    The estado of each row is only computed in SQL to filter on it: rows that
+    are returned get it from add_estado.
+    """
+    saldos = SaldoInventario.objects.exclude(cantidad=0)
+    if bodega_id is not None:
+        saldos = saldos.filter(bodega_id=bodega_id)
+    if subbodega is not None:
+        saldos = saldos.filter(subbodega__path__startswith=subbodega.path)
+    if q:
+        saldos = saldos.filter(search_condition(q, prefix='material__'))
+    if estado:
+        saldos = saldos.alias(**threshold_annotations()).alias(estado=estado_expression()).filter(estado=estado)
+    return saldos.values(*STOCK_ROW_FIELDS).order_by(*_order_by(ordering))
+
+
+def add_estado(rows):
+    """Sets the estado of the given rows (one page) from their thresholds, in one query."""
+    rows = list(rows)
+    umbrales = thresholds_for({row['material_id'] for row in rows if 'estado' not in row})
+    for row in rows:
+        if 'estado' not in row:
+            row['estado'] = stock_estado(row['cantidad'], resolve_threshold(umbrales, row['material_id'], row['bodega_id']))
+    return rows
+
+
+def stock_rows_from(inventory, q=None, bodega_id=None, subbodega=None, estado=None, ordering=None):
+    """The rows of stock_rows, built in memory from an inventory dict (e.g. stock_as_of)."""
+    inventory = {key: qty for key, qty in inventory.items() if qty != 0}
+    if bodega_id is not None:
+        inventory = {key: qty for key, qty in inventory.items() if key[1] == bodega_id}
+    if subbodega is not None:
+        subarbol = set(Subbodega.objects.filter(path__startswith=subbodega.path).values_list('id', flat=True))
+        inventory = {key: qty for key, qty in inventory.items() if key[2] in subarbol}
+
+    materiales = Material.objects.filter(id__in={key[0] for key in inventory})
+    if q:
+        materiales = materiales.filter(search_condition(q))
+    materiales = {m.id: m for m in materiales}
+    bodegas = dict(Bodega.objects.filter(id__in={key[1] for key in inventory}).values_list('id', 'nombre'))
+    sub_paths = dict(
+        Subbodega.objects.filter(id__in={key[2] for key in inventory if key[2]}).values_list('id', 'full_path')
+    )
+    umbrales = thresholds_for(materiales)
+
+    rows = []
+    for (mat_id, bod_id, sub_id), qty in inventory.items():
+        mat = materiales.get(mat_id)
+        if mat is None:
+            continue
+        fila_estado = stock_estado(qty, resolve_threshold(umbrales, mat_id, bod_id))
+        if estado and fila_estado != estado:
+            continue
+        rows.append({
+            'material_id': mat_id, 'material__codigo': mat.codigo, 'material__referencia': mat.referencia,
+            'material__nombre': mat.nombre, 'material__unidad': mat.unidad,
+            'bodega_id': bod_id, 'bodega__nombre': bodegas.get(bod_id),
+            'subbodega_id': sub_id, 'subbodega__full_path': sub_paths.get(sub_id),
+            'cantidad': qty, 'estado': fila_estado,
+        })
+
+    # Stable sorts, least significant key first, mirroring _order_by (missing values first)
+    for campo in reversed(_order_by(ordering)):
+        descending = campo.startswith('-')
+        campo = campo.lstrip('-')
+        rows.sort(key=lambda row: (row[campo] is not None, row[campo]), reverse=descending)
+    return rows
+
+
+def stock_tree(bodega):
+    """
+    The subbodega tree of a bodega with, at every node, the stock directly in it
+    (cantidad_propia), the stock of its whole subtree (cantidad) and the number
+    of materials with positive stock in the subtree (materiales). One pass over
+    the balances: each row is added to the node and every ancestor, read from
+    its materialized path.
+    """
+    nodos = {
+        nodo['id']: nodo
+        for nodo in Subbodega.objects.filter(bodega=bodega).values('id', 'nombre', 'activo', 'parent_id', 'path')
+    }
+    ancestros = {pk: [int(i) for i in nodo['path'].strip('/').split('/') if i] for pk, nodo in nodos.items()}
+
+    # node id (None for the whole bodega) -> {material_id: cantidad}
+    subarbol = defaultdict(lambda: defaultdict(int))
+    propia = defaultdict(int)
+    saldos = SaldoInventario.objects.filter(bodega=bodega).exclude(cantidad=0)
+    for material_id, subbodega_id, cantidad in saldos.values_list('material_id', 'subbodega_id', 'cantidad'):
+        propia[subbodega_id] += cantidad
+        subarbol[None][material_id] += cantidad
+        for pk in ancestros.get(subbodega_id, []):
+            subarbol[pk][material_id] += cantidad
+
+    def totales(pk):
+        materiales = subarbol.get(pk, {})
+        return sum(materiales.values()), sum(1 for cantidad in materiales.values() if cantidad > 0)
+
+    hijos = defaultdict(list)
+    for pk, nodo in nodos.items():
+        cantidad, materiales = totales(pk)
+        nodo.update(cantidad=cantidad, cantidad_propia=propia.get(pk, 0), materiales=materiales, hijos=hijos[pk])
+        hijos[nodo.pop('parent_id')].append(nodo)
+        del nodo['path']
+    for ramas in hijos.values():
+        ramas.sort(key=lambda nodo: (nodo['nombre'], nodo['id']))
+
+    cantidad, materiales = totales(None)
+    return {
+        'id': bodega.id,
+        'nombre': bodega.nombre,
+        'cantidad': cantidad,
+        'cantidad_general': propia.get(None, 0),
+        'materiales': materiales,
+        'subbodegas': hijos[None],
+    }
+
+
+def material_distribution(material):
+    """
+    Stock of one material in every location that has it, with bodega-qualified
+    paths and the total. One range read on the material index of the balances,
+    whatever the size of the rest of the table.
+    """
+    saldos = (
+        SaldoInventario.objects.filter(material=material).exclude(cantidad=0)
+        .values('bodega_id', 'bodega__nombre', 'subbodega_id', 'subbodega__full_path', 'subbodega__display_path', 'cantidad')
+        .order_by('bodega__nombre', 'subbodega__full_path')
+    )
+    existencias = [
+        {
+            'id_bodega': saldo['bodega_id'],
+            'bodega': saldo['bodega__nombre'],
+            'id_subbodega': saldo['subbodega_id'],
+            'subbodega': saldo['subbodega__full_path'] or "General",
+            'display_path': saldo['subbodega__display_path'] or f"{saldo['bodega__nombre']} - General",
+            'cantidad': saldo['cantidad'],
+        }
+        for saldo in saldos
+    ]
+    return {
+        'id_material': material.id,
+        'codigo': material.codigo,
+        'nombre': material.nombre,
+        'unidad': material.unidad,
+        'total': sum(existencia['cantidad'] for existencia in existencias),
+        'existencias': existencias,
+    }
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def sparse_fieldset(request):
+    """
+    Reads ?fields=a,b and ?omit=c from a read request. Returns (fields, omit)
+    as sets (fields is None when not given), or None when the request does not
+    ask for a sparse fieldset. Writes always use the full serializer.
+    """
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return None
+    fields = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+    if not fields and not omit:
+        return None
+    split = lambda value: {name.strip() for name in value.split(',') if name.strip()}
+    return (split(fields) if fields else None), (split(omit) if omit else set())
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin honoring ?fields= / ?omit= on the top-level serializer of
+    the request (or the child of a top-level list). Nested serializers keep all
+    their fields. Unknown names are ignored.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        top_level = self.root is self or (
+            self.parent is self.root and isinstance(self.root, serializers.ListSerializer)
+        )
+        sparse = sparse_fieldset(self.context.get('request')) if top_level else None
+        if sparse is not None:
+            keep, omit = sparse
+            for name in list(fields):
+                if (keep is not None and name not in keep) or name in omit:
+                    fields.pop(name)
+        return fields
+
+
+def _select_related_paths(select, prefix=''):
+    paths = []
+    for name, nested in select.items():
+        paths.append(prefix + name)
+        paths.extend(_select_related_paths(nested, prefix + name + '__'))
+    return paths
+
+
+def trim_queryset(queryset, serializer_fields):
+    """
+    Restricts a queryset to what the given serializer fields read: only() on
+    the columns they use and only the select_related / prefetch_related lookups
+    they traverse. Returns the queryset unchanged when a field reads something
+    that cannot be mapped to model fields (e.g. a SerializerMethodField).
+    """
+    opts = queryset.model._meta
+    columns = set()
+    traversed = set()
+    # Related columns read through dotted sources (marca.nombre); relations
+    # used as whole objects (nested serializers) are marked as None
+    related_columns = defaultdict(set)
+
+    for field in serializer_fields:
+        attrs = field.source_attrs
+        if not attrs:
+            return queryset
+        try:
+            model_field = opts.get_field(attrs[0])
+        except FieldDoesNotExist:
+            return queryset
+
+        if model_field.concrete:
+            columns.add(model_field.name)
+        if not model_field.is_relation:
+            continue
+        if len(attrs) == 1 and isinstance(field, serializers.RelatedField) and model_field.concrete:
+            # Primary key of the relation, already in this table
+            continue
+
+        traversed.add(attrs[0])
+        if len(attrs) == 2 and related_columns[attrs[0]] is not None:
+            try:
+                related_field = model_field.related_model._meta.get_field(attrs[1])
+            except FieldDoesNotExist:
+                related_field = None
+            if related_field is not None and related_field.concrete:
+                related_columns[attrs[0]].add(related_field.name)
+                continue
+        related_columns[attrs[0]] = None
+
+    select = queryset.query.select_related
+    select_paths = []
+    if isinstance(select, dict):
+        for path in _select_related_paths(select):
+            relation = path.split('__')[0]
+            # Deeper joins are only kept when the whole related object is loaded
+            if relation in traversed and (path == relation or related_columns[relation] is None):
+                select_paths.append(path)
+
+    prefetch = [
+        lookup for lookup in queryset._prefetch_related_lookups
+        if (lookup.prefetch_to if isinstance(lookup, Prefetch) else lookup).split('__')[0] in traversed
+    ]
+
+    only = set(columns)
+    for relation in traversed:
+        if relation in select_paths and related_columns[relation] is not None:
+            only.update(f"{relation}__{name}" for name in related_columns[relation])
+
+    if isinstance(select, dict):
+        # select_related() without arguments would follow every foreign key
+        queryset = queryset.select_related(None)
+        if select_paths:
+            queryset = queryset.select_related(*select_paths)
+    return queryset.prefetch_related(None).prefetch_related(*prefetch).only(opts.pk.name, *only)
+
+
+class SparseFieldsViewMixin:
+    """
+    ViewSet mixin making sparse fieldsets cheaper to produce, not just smaller:
+    list and retrieve querysets are trimmed to the fields being serialized.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.sparse_actions and sparse_fieldset(self.request) is not None:
+            queryset = trim_queryset(queryset, self.get_serializer().fields.values())
+        return queryset
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import datetime, time
+from inventario.cierres import PERIODOS_CIERRE, create_closing, period_start, refresh_closings
+from inventario.models import CierreInventario
+
+
+class Command(BaseCommand):
+    help = (
+        'Guarda un cierre de inventario (saldos por ubicación a la fecha de corte) y recalcula los cierres '
+        'invalidados por ediciones de movimientos. Pensado para cron, p. ej. el día 1 de cada mes: '
+        '"manage.py cerrar_inventario --periodo mes"'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help='Fecha de corte AAAA-MM-DD (cuenta los movimientos anteriores a ese día)')
+        parser.add_argument(
+            '--periodo', choices=sorted(PERIODOS_CIERRE), default='mes',
+            help='Sin --fecha, el corte es el inicio del período actual (por defecto: mes)'
+        )
+        parser.add_argument('--forzar', action='store_true', help='Recalcula el cierre aunque ya exista y esté vigente')
+
+    def handle(self, *args, **options):
+        refrescados = refresh_closings()
+        if refrescados:
+            self.stdout.write(f'Cierres recalculados: {refrescados}.')
+
+        if options['fecha']:
+            dia = parse_date(options['fecha'])
+            if dia is None:
+                raise CommandError('Fecha inválida, use AAAA-MM-DD.')
+            fecha = timezone.make_aware(datetime.combine(dia, time.min))
+        else:
+            fecha = period_start(options['periodo'])
+
+        # Idempotent, so a schedule may run it more often than the period
+        if not options['forzar'] and CierreInventario.objects.filter(fecha=fecha, vigente=True).exists():
+            self.stdout.write(f'El cierre al {fecha:%Y-%m-%d %H:%M} ya existe.')
+            return
+
+        cierre = create_closing(fecha)
+        self.stdout.write(self.style.SUCCESS(
+            f'Cierre al {cierre.fecha:%Y-%m-%d %H:%M} guardado: {cierre.saldos.count()} ubicaciones.'
+        ))
@@ -1,8 +1,10 @@
 import random
 from datetime import timedelta
+from django.db import transaction
 from django.utils import timezone
 from django.core.management.base import BaseCommand
 from inventario.models import Bodega, Subbodega, Material, Movimiento
+from inventario.signals import register_bulk_movements
 from django.contrib.auth import get_user_model
 
 class Command(BaseCommand):
@@ -103,6 +105,9 @@ class Command(BaseCommand):
             movimientos_a_crear.append(mov)
 
         # Bulk create es mejor para rendimiento
-        Movimiento.objects.bulk_create(movimientos_a_crear)
+        with transaction.atomic():
+            Movimiento.objects.bulk_create(movimientos_a_crear)
+            # bulk_create no dispara las señales: saldos, resúmenes, asientos y cierres se actualizan aquí
+            register_bulk_movements(movimientos_a_crear)
         
         self.stdout.write(self.style.SUCCESS(f'¡1000 movimientos de entrada creados con éxito en POLVORIN para {len(materials)} materiales diferentes!'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from inventario.reportes import invalidate_reports
+from inventario.series import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero los resúmenes diarios de movimientos usados por las series de reportes'
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write('Recalculando resúmenes de movimientos...')
+        total = rebuild_rollups()
+        invalidate_reports()
+        self.stdout.write(self.style.SUCCESS(f'Resúmenes reconstruidos: {total} filas.'))
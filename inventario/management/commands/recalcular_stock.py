@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from inventario.stock import rebuild_ledger, rebuild_stock_balances
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero la tabla de saldos de inventario a partir del historial de movimientos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Reescribe los asientos desde los movimientos y suma todo el historial, sin partir del último cierre'
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs['completo']:
+            self.stdout.write('Reescribiendo asientos de stock...')
+            self.stdout.write(f'Asientos: {rebuild_ledger()}.')
+        self.stdout.write('Recalculando saldos de inventario...')
+        total = rebuild_stock_balances(desde_cierre=not kwargs['completo'])
+        self.stdout.write(self.style.SUCCESS(f'Saldos reconstruidos: {total} ubicaciones.'))
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum, Case, When, F, Value
+
+
+def poblar_saldos(apps, schema_editor):
+    Movimiento = apps.get_model('inventario', 'Movimiento')
+    SaldoInventario = apps.get_model('inventario', 'SaldoInventario')
+
+    sources = Movimiento.objects.values('material', 'bodega', 'subbodega').annotate(
+        q=Sum(
+            Case(
+                When(tipo__in=['Entrada', 'Edicion', 'Ajuste', 'Devolucion'], then=F('cantidad')),
+                When(tipo__in=['Salida', 'Traslado'], then=-F('cantidad')),
+                default=Value(0)
+            )
+        )
+    )
+    destinations = Movimiento.objects.filter(tipo='Traslado', bodega_destino__isnull=False).values(
+        'material', 'bodega_destino', 'subbodega_destino'
+    ).annotate(q=Sum('cantidad'))
+
+    inventory = {}
+    for s in sources:
+        key = (s['material'], s['bodega'], s['subbodega'])
+        inventory[key] = inventory.get(key, 0) + (s['q'] or 0)
+    for d in destinations:
+        key = (d['material'], d['bodega_destino'], d['subbodega_destino'])
+        inventory[key] = inventory.get(key, 0) + (d['q'] or 0)
+
+    SaldoInventario.objects.bulk_create(
+        [SaldoInventario(material_id=m, bodega_id=b, subbodega_id=sub, cantidad=q) for (m, b, sub), q in inventory.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0014_alter_movimiento_fecha'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaldoInventario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cantidad', models.IntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('bodega', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='inventario.bodega')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='inventario.material')),
+                ('subbodega', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='inventario.subbodega')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bodega', 'subbodega'], name='saldo_bodega_sub_idx')],
+                'constraints': [models.UniqueConstraint(fields=('material', 'bodega', 'subbodega'), name='saldo_unico_por_ubicacion'), models.UniqueConstraint(condition=models.Q(('subbodega__isnull', True)), fields=('material', 'bodega'), name='saldo_unico_general')],
+            },
+        ),
+        migrations.RunPython(poblar_saldos, migrations.RunPython.noop),
+    ]
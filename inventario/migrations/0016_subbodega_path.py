@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+def poblar_paths(apps, schema_editor):
+    Subbodega = apps.get_model('inventario', 'Subbodega')
+    children = {}
+    for pk, parent_id in Subbodega.objects.values_list('id', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    paths = {}
+    pending = [(pk, '/') for pk in children.get(None, [])]
+    while pending:
+        pk, prefix = pending.pop()
+        paths[pk] = f"{prefix}{pk}/"
+        pending.extend((child, paths[pk]) for child in children.get(pk, []))
+
+    subs = list(Subbodega.objects.filter(id__in=paths.keys()))
+    for sub in subs:
+        sub.path = paths[sub.id]
+    Subbodega.objects.bulk_update(subs, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0015_saldoinventario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subbodega',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(poblar_paths, migrations.RunPython.noop),
+    ]
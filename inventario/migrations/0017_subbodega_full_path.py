@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:02
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def poblar_full_paths(apps, schema_editor):
+    Subbodega = apps.get_model('inventario', 'Subbodega')
+    subs = list(Subbodega.objects.select_related('bodega').order_by(Length('path')))
+    full_paths = {}
+    for sub in subs:
+        prefix = f"{full_paths[sub.parent_id]} > " if sub.parent_id in full_paths else ""
+        sub.full_path = f"{prefix}{sub.nombre}"
+        sub.display_path = f"{sub.bodega.nombre} - {sub.full_path}"
+        full_paths[sub.id] = sub.full_path
+    Subbodega.objects.bulk_update(subs, ['full_path', 'display_path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0016_subbodega_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subbodega',
+            name='display_path',
+            field=models.CharField(default='', editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='subbodega',
+            name='full_path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(poblar_full_paths, migrations.RunPython.noop),
+    ]
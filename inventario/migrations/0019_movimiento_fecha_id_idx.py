@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0018_tareareporte'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['-fecha', '-id'], name='mov_fecha_id_idx'),
+        ),
+    ]
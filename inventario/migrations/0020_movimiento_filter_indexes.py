@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0019_movimiento_fecha_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['material', '-fecha', '-id'], name='mov_material_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['bodega', '-fecha', '-id'], name='mov_bodega_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimiento',
+            index=models.Index(fields=['tipo', '-fecha', '-id'], name='mov_tipo_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:40
+
+from django.db import migrations
+
+# Frozen copy of the search index DDL as of this migration: later changes to
+# inventario.busqueda are applied by its ensure_search_index after migrate.
+SEARCH_FIELDS = ['codigo', 'codigo_barras', 'referencia', 'nombre']
+FTS_TABLE = 'inventario_material_fts'
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES (new.id, new.codigo, new.codigo_barras, new.referencia, new.nombre);
+        END""",
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES ('delete', old.id, old.codigo, old.codigo_barras, old.referencia, old.nombre);
+        END""",
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON inventario_material BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES ('delete', old.id, old.codigo, old.codigo_barras, old.referencia, old.nombre);
+            INSERT INTO {FTS_TABLE}(rowid, codigo, codigo_barras, referencia, nombre)
+            VALUES (new.id, new.codigo, new.codigo_barras, new.referencia, new.nombre);
+        END""",
+}
+
+
+def crear_indice_busqueda(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'sqlite':
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                    codigo, codigo_barras, referencia, nombre,
+                    content='inventario_material', content_rowid='id', tokenize='trigram'
+                )""")
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif schema_editor.connection.vendor == 'postgresql':
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for field in SEARCH_FIELDS:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS material_{field}_trgm_idx "
+                    f"ON inventario_material USING gin (UPPER({field}) gin_trgm_ops)"
+                )
+
+
+def eliminar_indice_busqueda(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if schema_editor.connection.vendor == 'sqlite':
+            for trigger in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif schema_editor.connection.vendor == 'postgresql':
+            for field in SEARCH_FIELDS:
+                cursor.execute(f"DROP INDEX IF EXISTS material_{field}_trgm_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0020_movimiento_filter_indexes'),
+    ]
+
+    operations = [
+        # FTS5 trigram table on SQLite, pg_trgm GIN indexes on PostgreSQL
+        migrations.RunPython(crear_indice_busqueda, eliminar_indice_busqueda),
+    ]
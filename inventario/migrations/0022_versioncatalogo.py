@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def crear_versiones(apps, schema_editor):
+    VersionCatalogo = apps.get_model('inventario', 'VersionCatalogo')
+    VersionCatalogo.objects.bulk_create([
+        VersionCatalogo(catalogo=catalogo, version=1)
+        for catalogo in ['material', 'marca', 'unidadmedida', 'bodega', 'subbodega']
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0021_material_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionCatalogo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('catalogo', models.CharField(max_length=50, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(crear_versiones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def poblar_resumenes(apps, schema_editor):
+    Movimiento = apps.get_model('inventario', 'Movimiento')
+    ResumenMovimiento = apps.get_model('inventario', 'ResumenMovimiento')
+    rows = (
+        Movimiento.objects.annotate(dia=TruncDate('fecha'))
+        .values('dia', 'material', 'bodega', 'subbodega', 'marca', 'tipo')
+        .annotate(total=Sum('cantidad'), n=Count('id'))
+        .order_by()
+    )
+    ResumenMovimiento.objects.bulk_create(
+        [
+            ResumenMovimiento(
+                dia=r['dia'], material_id=r['material'], bodega_id=r['bodega'], subbodega_id=r['subbodega'],
+                marca_id=r['marca'], tipo=r['tipo'], cantidad=r['total'] or 0, movimientos=r['n']
+            )
+            for r in rows.iterator()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0022_versioncatalogo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumenMovimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo', models.CharField(choices=[('Entrada', 'Entrada'), ('Salida', 'Salida'), ('Traslado', 'Traslado'), ('Edicion', 'Edición'), ('Ajuste', 'Ajuste'), ('Devolucion', 'Devolución')], max_length=20)),
+                ('cantidad', models.BigIntegerField(default=0)),
+                ('movimientos', models.IntegerField(default=0)),
+                ('bodega', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='inventario.bodega')),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumenes', to='inventario.marca')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resumenes', to='inventario.material')),
+                ('subbodega', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumenes', to='inventario.subbodega')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['material', 'dia', 'bodega', 'subbodega', 'marca', 'tipo'], name='resumen_clave_idx'), models.Index(fields=['dia', 'tipo'], name='resumen_dia_idx'), models.Index(fields=['bodega', 'dia'], name='resumen_bodega_dia_idx'), models.Index(fields=['marca', 'dia'], name='resumen_marca_dia_idx')],
+            },
+        ),
+        migrations.RunPython(poblar_resumenes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0023_resumenmovimiento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nivel', models.CharField(choices=[('minimo', 'Bajo el mínimo'), ('reorden', 'Bajo el nivel de reorden')], max_length=10)),
+                ('cantidad', models.IntegerField()),
+                ('minimo', models.PositiveIntegerField()),
+                ('reorden', models.PositiveIntegerField()),
+                ('desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('bodega', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas', to='inventario.bodega')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas', to='inventario.material')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['nivel', 'bodega'], name='alerta_nivel_bodega_idx')],
+                'constraints': [models.UniqueConstraint(fields=('material', 'bodega'), name='alerta_unica_por_bodega')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UmbralStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minimo', models.PositiveIntegerField(default=0)),
+                ('reorden', models.PositiveIntegerField(default=0)),
+                ('bodega', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='umbrales', to='inventario.bodega')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='umbrales', to='inventario.material')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('material', 'bodega'), name='umbral_unico_por_bodega'), models.UniqueConstraint(condition=models.Q(('bodega__isnull', True)), fields=('material',), name='umbral_unico_general')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0025_cierres_inventario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cierreinventario',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='cierreinventario',
+            name='vigente',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Sign rules of stock.movement_deltas as of this migration, frozen here
+TIPOS_ENTRADA = ['Entrada', 'Edicion', 'Ajuste', 'Devolucion']
+
+
+def movement_deltas(mov):
+    origen = (mov.material_id, mov.bodega_id, mov.subbodega_id)
+    if mov.tipo in TIPOS_ENTRADA:
+        return [(origen, mov.cantidad)]
+    if mov.tipo == 'Salida':
+        return [(origen, -mov.cantidad)]
+    if mov.tipo == 'Traslado':
+        deltas = [(origen, -mov.cantidad)]
+        if mov.bodega_destino_id:
+            deltas.append(((mov.material_id, mov.bodega_destino_id, mov.subbodega_destino_id), mov.cantidad))
+        return deltas
+    return []
+
+
+def poblar_asientos(apps, schema_editor):
+    Movimiento = apps.get_model('inventario', 'Movimiento')
+    AsientoStock = apps.get_model('inventario', 'AsientoStock')
+    movimientos = Movimiento.objects.only(
+        'id', 'tipo', 'cantidad', 'fecha', 'material', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino'
+    ).order_by()
+    AsientoStock.objects.bulk_create(
+        (
+            AsientoStock(
+                movimiento_id=mov.id, material_id=material_id, bodega_id=bodega_id,
+                subbodega_id=subbodega_id, fecha=mov.fecha, delta=delta
+            )
+            for mov in movimientos.iterator(chunk_size=2000)
+            for (material_id, bodega_id, subbodega_id), delta in movement_deltas(mov)
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0026_cierre_vigente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AsientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateTimeField()),
+                ('delta', models.IntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='asientostock',
+            name='bodega',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asientos', to='inventario.bodega'),
+        ),
+        migrations.AddField(
+            model_name='asientostock',
+            name='material',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asientos', to='inventario.material'),
+        ),
+        migrations.AddField(
+            model_name='asientostock',
+            name='movimiento',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='asientos', to='inventario.movimiento'),
+        ),
+        migrations.AddField(
+            model_name='asientostock',
+            name='subbodega',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='asientos', to='inventario.subbodega'),
+        ),
+        migrations.AddIndex(
+            model_name='asientostock',
+            index=models.Index(fields=['material', 'bodega', 'subbodega', 'fecha', 'delta'], name='asiento_ubicacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='asientostock',
+            index=models.Index(fields=['fecha', 'material', 'bodega', 'subbodega', 'delta'], name='asiento_fecha_idx'),
+        ),
+        migrations.RunPython(poblar_asientos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def poblar_destinos(apps, schema_editor):
+    # Existing Traslado rollups have no destination: recompute the rollups with it
+    Movimiento = apps.get_model('inventario', 'Movimiento')
+    ResumenMovimiento = apps.get_model('inventario', 'ResumenMovimiento')
+    rows = (
+        Movimiento.objects.annotate(dia=TruncDate('fecha'))
+        .values('dia', 'material', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino', 'marca', 'tipo')
+        .annotate(total=Sum('cantidad'), n=Count('id'))
+        .order_by()
+    )
+    ResumenMovimiento.objects.all().delete()
+    ResumenMovimiento.objects.bulk_create(
+        (
+            ResumenMovimiento(
+                dia=r['dia'], material_id=r['material'], bodega_id=r['bodega'], subbodega_id=r['subbodega'],
+                bodega_destino_id=r['bodega_destino'], subbodega_destino_id=r['subbodega_destino'],
+                marca_id=r['marca'], tipo=r['tipo'], cantidad=r['total'] or 0, movimientos=r['n']
+            )
+            for r in rows.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0028_movimiento_bodega_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resumenmovimiento',
+            name='bodega_destino',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumenes_recibidos', to='inventario.bodega'),
+        ),
+        migrations.AddField(
+            model_name='resumenmovimiento',
+            name='subbodega_destino',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resumenes_recibidos', to='inventario.subbodega'),
+        ),
+        migrations.AddIndex(
+            model_name='resumenmovimiento',
+            index=models.Index(fields=['bodega_destino', 'dia'], name='resumen_destino_dia_idx'),
+        ),
+        migrations.RunPython(poblar_destinos, migrations.RunPython.noop),
+    ]
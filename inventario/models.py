@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Length, Substr
 from django.utils import timezone
 from django.conf import settings
 
@@ -7,6 +9,15 @@ class Bodega(models.Model):
     ubicacion = models.CharField(max_length=255, blank=True)
     activo = models.BooleanField(default=True)
 
+    def save(self, *args, **kwargs):
+        old_nombre = None
+        if self.pk and not self._state.adding:
+            old_nombre = Bodega.objects.filter(pk=self.pk).values_list('nombre', flat=True).first()
+        super().save(*args, **kwargs)
+        if old_nombre is not None and old_nombre != self.nombre:
+            # Keep the bodega-qualified display path of its subbodegas in sync
+            self.subbodegas.update(display_path=Concat(Value(f"{self.nombre} - "), 'full_path'))
+
     def __str__(self):
         return self.nombre
 
@@ -15,14 +26,99 @@ class Subbodega(models.Model):
     bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='subbodegas')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
     activo = models.BooleanField(default=True)
+    # Materialized path of ids from the root, e.g. "/3/17/42/". Maintained in save().
+    path = models.CharField(max_length=500, db_index=True, editable=False, default='')
+    # Denormalized names ("ESTANTE 1A > FILA 2" and "POLVORIN - ESTANTE 1A > FILA 2"),
+    # recomputed for the whole subtree on rename or re-parent.
+    full_path = models.CharField(max_length=500, db_index=True, editable=False, default='')
+    display_path = models.CharField(max_length=500, editable=False, default='')
+
+    def _build_path(self):
+        prefix = self.parent.path if self.parent_id else '/'
+        return f"{prefix}{self.pk}/"
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and self.pk and f"/{self.pk}/" in self.parent.path:
+            raise ValueError("Una subbodega no puede ser hija de sí misma ni de sus descendientes.")
+
+        old = None
+        if self.pk and not self._state.adding:
+            old = Subbodega.objects.filter(pk=self.pk).values('path', 'nombre', 'parent_id', 'bodega_id').first()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            new_path = self._build_path()
+            if new_path != self.path:
+                self.path = new_path
+                Subbodega.objects.filter(pk=self.pk).update(path=new_path)
+            if old and old['path'] != new_path:
+                # Re-parented: rewrite the prefix of the whole subtree in one statement
+                Subbodega.objects.filter(path__startswith=old['path']).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old['path']) + 1))
+                )
+            if (
+                old is None or not self.full_path
+                or (old['nombre'], old['parent_id'], old['bodega_id']) != (self.nombre, self.parent_id, self.bodega_id)
+            ):
+                self._refresh_subtree_names()
+
+    def _refresh_subtree_names(self):
+        prefix = f"{self.parent.full_path} > " if self.parent_id else ""
+        self.full_path = f"{prefix}{self.nombre}"
+        self.display_path = f"{self.bodega.nombre} - {self.full_path}"
+        Subbodega.objects.filter(pk=self.pk).update(full_path=self.full_path, display_path=self.display_path)
+
+        # Parents always sort before their children by path length
+        descendants = list(
+            Subbodega.objects.filter(path__startswith=self.path).exclude(pk=self.pk)
+            .select_related('bodega').order_by(Length('path'))
+        )
+        full_paths = {self.pk: self.full_path}
+        for node in descendants:
+            node.full_path = f"{full_paths[node.parent_id]} > {node.nombre}"
+            node.display_path = f"{node.bodega.nombre} - {node.full_path}"
+            full_paths[node.pk] = node.full_path
+        Subbodega.objects.bulk_update(descendants, ['full_path', 'display_path'], batch_size=500)
+
+    @classmethod
+    def rebuild_tree(cls):
+        """
+        Recomputes path, full_path and display_path of every subbodega from the
+        parent links. Used after bulk writes, which bypass save().
+        """
+        nodes = list(cls.objects.select_related('bodega'))
+        children = {}
+        for node in nodes:
+            children.setdefault(node.parent_id, []).append(node)
+
+        pending = [(node, None) for node in children.get(None, [])]
+        while pending:
+            node, parent = pending.pop()
+            node.path = f"{parent.path if parent else '/'}{node.pk}/"
+            node.full_path = f"{parent.full_path} > {node.nombre}" if parent else node.nombre
+            node.display_path = f"{node.bodega.nombre} - {node.full_path}"
+            pending.extend((child, node) for child in children.get(node.pk, []))
+        cls.objects.bulk_update(nodes, ['path', 'full_path', 'display_path'], batch_size=500)
+
+    def get_ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip('/').split('/')[:-1] if pk]
+
+    def get_ancestors(self):
+        """Ancestors from the root down, in one query."""
+        return Subbodega.objects.filter(id__in=self.get_ancestor_ids()).order_by(Length('path'))
+
+    def get_descendants(self, include_self=True):
+        """Whole subtree in one indexed prefix query."""
+        queryset = Subbodega.objects.filter(path__startswith=self.path)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
 
     def get_full_path(self):
-        if self.parent:
-            return f"{self.parent.get_full_path()} > {self.nombre}"
-        return self.nombre
+        return self.full_path or self.nombre
 
     def __str__(self):
-        return f"{self.bodega.nombre} - {self.get_full_path()}"
+        return self.display_path or self.nombre
 
 class Material(models.Model):
     codigo = models.CharField(max_length=50, unique=True)
@@ -70,7 +166,8 @@ class Movimiento(models.Model):
     ]
     
     material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='movimientos')
-    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='movimientos')
+    # Indexed by mov_bodega_fecha_idx, which the planner then also uses for bodega filters
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='movimientos', db_index=False)
     subbodega = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos')
     bodega_destino = models.ForeignKey(Bodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='traslados_recibidos')
     subbodega_destino = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='traslados_recibidos')
@@ -83,5 +180,220 @@ class Movimiento(models.Model):
     tipo = models.CharField(max_length=20, choices=TIPO_MOVIMIENTO)
     observaciones = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Kardex order and keyset pagination
+            models.Index(fields=['-fecha', '-id'], name='mov_fecha_id_idx'),
+            # Kardex filtered by material / bodega / tipo, in the same order
+            models.Index(fields=['material', '-fecha', '-id'], name='mov_material_fecha_idx'),
+            models.Index(fields=['bodega', '-fecha', '-id'], name='mov_bodega_fecha_idx'),
+            models.Index(fields=['tipo', '-fecha', '-id'], name='mov_tipo_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"{self.tipo} - {self.material.nombre} - {self.cantidad}"
+
+class AsientoStock(models.Model):
+    """
+    Efecto firmado de un Movimiento sobre una ubicación: un asiento por ubicación afectada
+    (un Traslado tiene dos, la salida y la llegada). El stock de cualquier ubicación o fecha
+    es SUM(delta) de sus asientos; las reglas de signo por tipo viven solo en stock.movement_deltas.
+    """
+    movimiento = models.ForeignKey(Movimiento, on_delete=models.CASCADE, related_name='asientos')
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='asientos')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='asientos')
+    subbodega = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='asientos')
+    # Copy of movimiento.fecha, for stock at a date
+    fecha = models.DateTimeField()
+    delta = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # Covering indexes: stock per location (also over a fecha range, by skip-scan on SQLite),
+            # and by fecha range first for backends without skip-scan
+            models.Index(fields=['material', 'bodega', 'subbodega', 'fecha', 'delta'], name='asiento_ubicacion_idx'),
+            models.Index(fields=['fecha', 'material', 'bodega', 'subbodega', 'delta'], name='asiento_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.movimiento_id}: {self.material_id} @ {self.bodega_id}/{self.subbodega_id} {self.delta:+d}"
+
+class SaldoInventario(models.Model):
+    """Stock materializado por (material, bodega, subbodega), mantenido en cada escritura de Movimiento."""
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='saldos')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='saldos')
+    subbodega = models.ForeignKey(Subbodega, on_delete=models.CASCADE, null=True, blank=True, related_name='saldos')
+    cantidad = models.IntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['material', 'bodega', 'subbodega'], name='saldo_unico_por_ubicacion'),
+            # NULLs are distinct in unique indexes, so "General" (no subbodega) needs its own constraint
+            models.UniqueConstraint(
+                fields=['material', 'bodega'],
+                condition=models.Q(subbodega__isnull=True),
+                name='saldo_unico_general'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['bodega', 'subbodega'], name='saldo_bodega_sub_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.material_id} @ {self.bodega_id}/{self.subbodega_id}: {self.cantidad}"
+
+class ResumenMovimiento(models.Model):
+    """
+    Movimientos sumados por (día, material, bodega, subbodega, destino, marca, tipo), mantenido en
+    cada escritura de Movimiento. Las series de reportes suman estas filas en vez de los movimientos.
+    El destino (solo en traslados) permite filtrar por ubicación como el kardex, sin contar dos veces.
+    Sin clave única: al borrar una subbodega o marca las filas quedan en NULL igual que sus
+    movimientos, y las lecturas siempre agregan.
+    """
+    dia = models.DateField()
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='resumenes')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='resumenes')
+    subbodega = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='resumenes')
+    bodega_destino = models.ForeignKey(Bodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='resumenes_recibidos')
+    subbodega_destino = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='resumenes_recibidos')
+    marca = models.ForeignKey('Marca', on_delete=models.SET_NULL, null=True, blank=True, related_name='resumenes')
+    tipo = models.CharField(max_length=20, choices=Movimiento.TIPO_MOVIMIENTO)
+    cantidad = models.BigIntegerField(default=0)
+    movimientos = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Incremental updates look rows up by their full key; material series use the prefix
+            models.Index(fields=['material', 'dia', 'bodega', 'subbodega', 'marca', 'tipo'], name='resumen_clave_idx'),
+            models.Index(fields=['dia', 'tipo'], name='resumen_dia_idx'),
+            models.Index(fields=['bodega', 'dia'], name='resumen_bodega_dia_idx'),
+            models.Index(fields=['bodega_destino', 'dia'], name='resumen_destino_dia_idx'),
+            models.Index(fields=['marca', 'dia'], name='resumen_marca_dia_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} {self.tipo} {self.material_id} @ {self.bodega_id}: {self.cantidad}"
+
+class CierreInventario(models.Model):
+    """
+    Corte de inventario: saldos por ubicación con todos los movimientos anteriores a fecha.
+    Las consultas de stock a una fecha parten del corte más cercano en vez de toda la historia.
+    """
+    fecha = models.DateTimeField(unique=True)
+    # False once a movement before fecha changes; cerrar_inventario recomputes it
+    vigente = models.BooleanField(default=True)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='cierres')
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"Cierre {self.fecha:%Y-%m-%d %H:%M}"
+
+class SaldoCierre(models.Model):
+    """
+    Saldo de una ubicación en un cierre, también en cero (como SaldoInventario, para que el saldo
+    reconstruido desde el cierre conserve las filas). Sin clave única, igual que ResumenMovimiento:
+    las lecturas agregan.
+    """
+    cierre = models.ForeignKey(CierreInventario, on_delete=models.CASCADE, related_name='saldos')
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='saldos_cierre')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='saldos_cierre')
+    subbodega = models.ForeignKey(Subbodega, on_delete=models.SET_NULL, null=True, blank=True, related_name='saldos_cierre')
+    cantidad = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cierre', 'bodega'], name='saldo_cierre_bodega_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cierre_id}: {self.material_id} @ {self.bodega_id}/{self.subbodega_id}: {self.cantidad}"
+
+class UmbralStock(models.Model):
+    """Niveles mínimo y de reorden de un material, para todas las bodegas (bodega vacía) o para una en particular."""
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='umbrales')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, null=True, blank=True, related_name='umbrales')
+    minimo = models.PositiveIntegerField(default=0)
+    reorden = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['material', 'bodega'], name='umbral_unico_por_bodega'),
+            models.UniqueConstraint(
+                fields=['material'], condition=models.Q(bodega__isnull=True), name='umbral_unico_general'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.material_id} @ {self.bodega_id or 'todas'}: min {self.minimo}, reorden {self.reorden}"
+
+class AlertaStock(models.Model):
+    """Material por debajo de su nivel de reorden (o mínimo) en una bodega, mantenido en cada cambio de saldo."""
+    NIVELES = [
+        ('minimo', 'Bajo el mínimo'),
+        ('reorden', 'Bajo el nivel de reorden'),
+    ]
+
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, related_name='alertas')
+    bodega = models.ForeignKey(Bodega, on_delete=models.CASCADE, related_name='alertas')
+    nivel = models.CharField(max_length=10, choices=NIVELES)
+    cantidad = models.IntegerField()
+    minimo = models.PositiveIntegerField()
+    reorden = models.PositiveIntegerField()
+    # When the material went below its reorder level
+    desde = models.DateTimeField(default=timezone.now)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['material', 'bodega'], name='alerta_unica_por_bodega'),
+        ]
+        indexes = [
+            models.Index(fields=['nivel', 'bodega'], name='alerta_nivel_bodega_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_nivel_display()}: {self.material_id} @ {self.bodega_id} ({self.cantidad})"
+
+class TareaReporte(models.Model):
+    """Importación o exportación de Excel ejecutada en segundo plano."""
+    TIPOS = [
+        ('importacion', 'Importación'),
+        ('exportacion', 'Exportación'),
+        ('plantilla', 'Plantilla'),
+    ]
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completada', 'Completada'),
+        ('error', 'Error'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPOS)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente', db_index=True)
+    # Rows processed per sheet, e.g. {"Movimientos": 12000}
+    progreso = models.JSONField(default=dict, blank=True)
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, null=True)
+    # Uploaded workbook for imports, produced workbook for exports
+    archivo = models.FileField(upload_to='tareas/', blank=True, null=True)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='tareas_reporte')
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+    finalizado = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.pk} ({self.estado})"
+
+class VersionCatalogo(models.Model):
+    """Versión de un catálogo (material, marca, bodega...), incrementada en cada escritura. Base de los ETag de la API."""
+    catalogo = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.catalogo} v{self.version}"
@@ -0,0 +1,133 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import response
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over (fecha, id), newest first. Each page is a range scan
+    on the (fecha, id) index that starts after the last row of the previous
+    page, so deep pages cost the same as the first one. Cursors are opaque and
+    no COUNT(*) is issued unless ?incluir_conteo=true is sent.
+    """
+    page_size = PageNumberPagination.page_size
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def encode_cursor(self, reverse, obj):
+        raw = f"{'r' if reverse else 'n'}|{obj.fecha.isoformat()}|{obj.pk}"
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            direction, fecha, pk = urlsafe_b64decode(encoded.encode()).decode().split('|')
+            fecha = parse_datetime(fecha)
+            if direction not in ('n', 'r') or fecha is None:
+                raise ValueError
+            return direction == 'r', fecha, int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get('incluir_conteo', 'false').lower() == 'true':
+            self.count = queryset.count()
+
+        reverse = False
+        queryset = queryset.order_by('-fecha', '-id')
+        if cursor is not None:
+            reverse, fecha, pk = cursor
+            if reverse:
+                queryset = queryset.filter(Q(fecha__gt=fecha) | Q(fecha=fecha, id__gt=pk)).order_by('fecha', 'id')
+            else:
+                queryset = queryset.filter(Q(fecha__lt=fecha) | Q(fecha=fecha, id__lt=pk))
+
+        # One extra row tells whether there is more in the scan direction
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = cursor is not None and (has_more if reverse else True)
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(False, self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(True, self.page[0]))
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            body = {'count': self.count, **body}
+        return response.Response(body)
+
+
+class KardexPagination(PageNumberPagination):
+    """
+    Page-number pagination as everywhere else, switching to KeysetPagination
+    when the client asks for it with ?paginacion=cursor (the links it returns
+    carry the cursor).
+    """
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if request.query_params.get('paginacion') == 'cursor' or KeysetPagination.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class StockPagination(PageNumberPagination):
+    """
+    Page-number pagination for the stock summaries, opt-in: only requests that
+    send ?page= or ?page_size= get a page, the others keep the full list.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.page_query_param in params or self.page_size_query_param in params
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import time
+from django.core.cache import cache
+
+# Reports are cached under a generation number that every write to the data
+# they read (Movimiento, Marca, imports) replaces, so invalidation is O(1) and
+# needs no key bookkeeping. Entries of old generations just expire.
+REPORT_CACHE_TIMEOUT = 60 * 5
+# How long a miss may hold the recompute lock, and how long others wait for it
+REPORT_LOCK_TIMEOUT = 30
+REPORT_WAIT = 10
+REPORT_POLL = 0.05
+
+_GENERATION_KEY = 'reportes:generacion'
+
+
+def _generation():
+    # A timestamp rather than a counter, so an evicted generation cannot reuse old keys
+    return cache.get_or_set(_GENERATION_KEY, time.time_ns, timeout=None)
+
+
+def invalidate_reports():
+    """Retires every cached report. Call after commit, so no reader recomputes from stale rows."""
+    cache.set(_GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def report_cache_key(nombre, params=None):
+    raw = json.dumps(params or {}, sort_keys=True, default=str)
+    return f"reportes:{_generation()}:{nombre}:{hashlib.md5(raw.encode()).hexdigest()}"
+
+
+def cached_report(nombre, params, compute):
+    """
+    Returns the cached result of compute() for this report and parameters.
+    Concurrent misses are coalesced: the first one takes a lock (cache.add) and
+    recomputes, the others poll for its result instead of running the query too.
+    """
+    key = report_cache_key(nombre, params)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    lock = f"{key}:lock"
+    if cache.add(lock, 1, timeout=REPORT_LOCK_TIMEOUT):
+        try:
+            data = compute()
+            cache.set(key, data, timeout=REPORT_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock)
+        return data
+
+    deadline = time.monotonic() + REPORT_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(REPORT_POLL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+        if cache.get(lock) is None:
+            # The holder failed or its result was already retired
+            break
+    return compute()
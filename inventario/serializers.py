@@ -1,91 +1,142 @@
 from rest_framework import serializers
-from django.db.models import Q, Sum
-from .models import Bodega, Subbodega, Material, Factura, Movimiento, Marca, UnidadMedida
+from rest_framework.settings import api_settings
+from django.db import models, transaction
+from .models import (
+    Bodega, Subbodega, Material, Factura, Movimiento, Marca, UnidadMedida, TareaReporte, UmbralStock, AlertaStock
+)
+from .tareas import job_progress
+from .fieldsets import SparseFieldsMixin
+from .stock import TIPOS_SALIDA, available_stock, count_materials_by_bodega, movement_deltas
 from usuarios.serializers import UsuarioSerializer
 
-class MarcaSerializer(serializers.ModelSerializer):
+class MarcaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Marca
         fields = ['id', 'nombre', 'activo']
 
-class UnidadMedidaSerializer(serializers.ModelSerializer):
+class UnidadMedidaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = UnidadMedida
         fields = ['id', 'nombre', 'abreviacion', 'activo']
 
-class SubbodegaSerializer(serializers.ModelSerializer):
-    full_path = serializers.ReadOnlyField(source='get_full_path')
-    
+class SubbodegaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Subbodega
-        fields = ['id', 'nombre', 'full_path', 'bodega', 'parent', 'activo']
+        fields = ['id', 'nombre', 'full_path', 'display_path', 'bodega', 'parent', 'activo']
+
+    def validate_parent(self, parent):
+        if parent and self.instance and f"/{self.instance.pk}/" in parent.path:
+            raise serializers.ValidationError("Una subbodega no puede ser hija de sí misma ni de sus descendientes.")
+        return parent
 
-class SubbodegaSimpleSerializer(serializers.ModelSerializer):
+class SubbodegaSimpleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Lighter version without full_path for deeply nested lists"""
     class Meta:
         model = Subbodega
         fields = ['id', 'nombre', 'bodega', 'parent', 'activo']
 
-class BodegaSimpleSerializer(serializers.ModelSerializer):
+class BodegaSimpleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     subbodegas = SubbodegaSimpleSerializer(many=True, read_only=True)
     
     class Meta:
         model = Bodega
         fields = ['id', 'nombre', 'ubicacion', 'activo', 'subbodegas']
 
-class BodegaSerializer(serializers.ModelSerializer):
+class BodegaListSerializer(serializers.ListSerializer):
+    """Computes materiales_count for every bodega of the list in one grouped query."""
+    def to_representation(self, data):
+        bodegas = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'materiales_count' in self.child.fields:
+            self.child.materiales_count_map = count_materials_by_bodega([b.id for b in bodegas])
+        return super().to_representation(bodegas)
+
+class BodegaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     materiales_count = serializers.SerializerMethodField()
     subbodegas = SubbodegaSimpleSerializer(many=True, read_only=True)
     
     class Meta:
         model = Bodega
         fields = ['id', 'nombre', 'ubicacion', 'activo', 'materiales_count', 'subbodegas']
+        list_serializer_class = BodegaListSerializer
     
     def get_materiales_count(self, obj):
-        from django.db.models import Sum, Case, When, F, Value
-        
-        # Calculate stock per material using efficient aggregation (only 2 queries)
-        sources = Movimiento.objects.filter(bodega=obj).values('material').annotate(
-            stock=Sum(
-                Case(
-                    When(tipo__in=['Entrada', 'Edicion', 'Ajuste', 'Devolucion'], then=F('cantidad')),
-                    When(tipo__in=['Salida', 'Traslado'], then=-F('cantidad')),
-                    default=Value(0)
-                )
-            )
-        )
-        
-        destinations = Movimiento.objects.filter(bodega_destino=obj).values('material').annotate(
-            stock=Sum(
-                Case(
-                    When(tipo='Traslado', then=F('cantidad')),
-                    default=Value(0)
-                )
-            )
-        )
-        
-        stock_map = {}
-        for s in sources:
-            stock_map[s['material']] = s['stock'] or 0
-        for d in destinations:
-            mat_id = d['material']
-            stock_map[mat_id] = stock_map.get(mat_id, 0) + (d['stock'] or 0)
-            
-        return sum(1 for qty in stock_map.values() if qty > 0)
-
-class MaterialSerializer(serializers.ModelSerializer):
+        # Materials with positive stock in this bodega, read from the materialized balances
+        counts = getattr(self, 'materiales_count_map', None)
+        if counts is None:
+            counts = count_materials_by_bodega([obj.id])
+        return counts.get(obj.id, 0)
+
+class MaterialSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     marca_nombre = serializers.ReadOnlyField(source='marca.nombre')
 
     class Meta:
         model = Material
         fields = ['id', 'codigo', 'codigo_barras', 'referencia', 'nombre', 'unidad', 'marca', 'marca_nombre']
 
-class FacturaSerializer(serializers.ModelSerializer):
+class FacturaSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Factura
         fields = '__all__'
 
-class MovimientoSerializer(serializers.ModelSerializer):
+class UmbralStockSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    material_codigo = serializers.ReadOnlyField(source='material.codigo')
+    bodega_nombre = serializers.ReadOnlyField(source='bodega.nombre', default=None)
+
+    class Meta:
+        model = UmbralStock
+        fields = ['id', 'material', 'material_codigo', 'bodega', 'bodega_nombre', 'minimo', 'reorden']
+        # Uniqueness (including the general, bodega-less threshold) is checked in validate
+        validators = []
+
+    def validate(self, data):
+        minimo = data.get('minimo', self.instance.minimo if self.instance else 0)
+        reorden = data.get('reorden', self.instance.reorden if self.instance else 0)
+        if reorden < minimo:
+            raise serializers.ValidationError({"reorden": "El nivel de reorden no puede ser menor que el mínimo."})
+
+        material = data.get('material', self.instance.material if self.instance else None)
+        bodega = data.get('bodega', self.instance.bodega if self.instance else None)
+        duplicados = UmbralStock.objects.filter(material=material, bodega=bodega)
+        if self.instance:
+            duplicados = duplicados.exclude(pk=self.instance.pk)
+        if duplicados.exists():
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ["Ya existe un umbral para este material en esa bodega."]
+            })
+        return data
+
+class AlertaStockSerializer(serializers.ModelSerializer):
+    material_codigo = serializers.ReadOnlyField(source='material.codigo')
+    material_nombre = serializers.ReadOnlyField(source='material.nombre')
+    unidad = serializers.ReadOnlyField(source='material.unidad')
+    bodega_nombre = serializers.ReadOnlyField(source='bodega.nombre')
+
+    class Meta:
+        model = AlertaStock
+        fields = [
+            'id', 'material', 'material_codigo', 'material_nombre', 'unidad', 'bodega', 'bodega_nombre',
+            'nivel', 'cantidad', 'minimo', 'reorden', 'desde', 'actualizado'
+        ]
+
+class TareaReporteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    progreso = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TareaReporte
+        fields = ['id', 'tipo', 'estado', 'progreso', 'resultado', 'error', 'creado', 'actualizado', 'finalizado']
+        read_only_fields = fields
+
+    def get_progreso(self, obj):
+        # Running jobs publish their progress in the cache (see tareas.py)
+        return job_progress(obj)
+
+def validar_traslado(bodega_origen, subbodega_origen, bodega_destino, subbodega_destino):
+    if not bodega_destino:
+        raise serializers.ValidationError({"bodega_destino": "Debe seleccionar una bodega de destino para un traslado."})
+    if bodega_origen == bodega_destino and subbodega_origen == subbodega_destino:
+        raise serializers.ValidationError({"subbodega_destino": "La ubicación de destino no puede ser la misma que la de origen."})
+
+class MovimientoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     material_info = MaterialSerializer(source='material', read_only=True)
     bodega_info = BodegaSimpleSerializer(source='bodega', read_only=True)
     subbodega_info = SubbodegaSimpleSerializer(source='subbodega', read_only=True)
@@ -109,46 +160,192 @@ class MovimientoSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
         tipo = data.get('tipo', self.instance.tipo if self.instance else None)
-        if tipo in ['Salida', 'Traslado']:
-            material = data.get('material', self.instance.material if self.instance else None)
-            bodega_origen = data.get('bodega', self.instance.bodega if self.instance else None)
-            subbodega_origen = data.get('subbodega', self.instance.subbodega if self.instance else None)
-            cantidad_solicitada = data.get('cantidad', self.instance.cantidad if self.instance else 0)
-
-            if tipo == 'Traslado':
-                bodega_destino = data.get('bodega_destino')
-                subbodega_destino = data.get('subbodega_destino')
-                if not bodega_destino:
-                    raise serializers.ValidationError({"bodega_destino": "Debe seleccionar una bodega de destino para un traslado."})
-                if bodega_origen == bodega_destino and subbodega_origen == subbodega_destino:
-                    raise serializers.ValidationError({"subbodega_destino": "La ubicación de destino no puede ser la misma que la de origen."})
-
-            # Calculate stock in specific subbodega
-            movimientos = Movimiento.objects.filter(material=material).filter(
-                Q(bodega=bodega_origen, subbodega=subbodega_origen) | 
-                Q(bodega_destino=bodega_origen, subbodega_destino=subbodega_origen)
+        if tipo == 'Traslado':
+            validar_traslado(
+                data.get('bodega', self.instance.bodega if self.instance else None),
+                data.get('subbodega', self.instance.subbodega if self.instance else None),
+                data.get('bodega_destino', self.instance.bodega_destino if self.instance else None),
+                data.get('subbodega_destino', self.instance.subbodega_destino if self.instance else None)
             )
-            
-            stock_actual = 0
-            for mov in movimientos:
-                if self.instance and mov.id == self.instance.id:
-                    continue
-                
-                if mov.tipo in ['Entrada', 'Edicion', 'Ajuste', 'Devolucion']:
-                    if mov.bodega_id == bodega_origen.id and mov.subbodega_id == (subbodega_origen.id if subbodega_origen else None):
-                        stock_actual += mov.cantidad
-                elif mov.tipo == 'Salida':
-                    if mov.bodega_id == bodega_origen.id and mov.subbodega_id == (subbodega_origen.id if subbodega_origen else None):
-                        stock_actual -= mov.cantidad
-                elif mov.tipo == 'Traslado':
-                    if mov.bodega_id == bodega_origen.id and mov.subbodega_id == (subbodega_origen.id if subbodega_origen else None):
-                        stock_actual -= mov.cantidad
-                    if mov.bodega_destino_id == bodega_origen.id and mov.subbodega_destino_id == (subbodega_origen.id if subbodega_origen else None):
-                        stock_actual += mov.cantidad
-            
-            if cantidad_solicitada > stock_actual:
-                loc_name = subbodega_origen.nombre if subbodega_origen else "General"
-                raise serializers.ValidationError(
-                    f"Stock insuficiente en {bodega_origen.nombre} ({loc_name}). Disponible: {stock_actual} {material.unidad}."
-                )
         return data
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            self._validar_stock(validated_data)
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            self._validar_stock(validated_data)
+            return super().update(instance, validated_data)
+
+    def _validar_stock(self, data):
+        """
+        Checks stock for Salida and Traslado against the locked balance row of the
+        origin location. Must run inside the transaction that saves the movement.
+        """
+        tipo = data.get('tipo', self.instance.tipo if self.instance else None)
+        if tipo not in TIPOS_SALIDA:
+            return
+
+        material = data.get('material', self.instance.material if self.instance else None)
+        bodega_origen = data.get('bodega', self.instance.bodega if self.instance else None)
+        subbodega_origen = data.get('subbodega', self.instance.subbodega if self.instance else None)
+        cantidad_solicitada = data.get('cantidad', self.instance.cantidad if self.instance else 0)
+
+        key = (material.id, bodega_origen.id, subbodega_origen.id if subbodega_origen else None)
+        stock_actual = available_stock(*key, lock=True)
+
+        # When editing, the stored version of this movement is already in the balance
+        if self.instance:
+            stock_actual -= sum(delta for k, delta in movement_deltas(self.instance) if k == key)
+
+        if cantidad_solicitada > stock_actual:
+            loc_name = subbodega_origen.nombre if subbodega_origen else "General"
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    f"Stock insuficiente en {bodega_origen.nombre} ({loc_name}). Disponible: {stock_actual} {material.unidad}."
+                ]
+            })
+
+
+class BodegaResumenSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Bodega without its subbodegas, for embedding in movement rows"""
+    class Meta:
+        model = Bodega
+        fields = ['id', 'nombre', 'ubicacion', 'activo']
+
+class MovimientoListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Compact movement row for the list endpoint: related objects are flattened to
+    id + name columns read from the joined rows. Nested objects can be requested
+    with ?expand=material,bodega,... (see expandable_fields).
+    """
+    material_codigo = serializers.ReadOnlyField(source='material.codigo')
+    material_nombre = serializers.ReadOnlyField(source='material.nombre')
+    material_unidad = serializers.ReadOnlyField(source='material.unidad')
+    bodega_nombre = serializers.ReadOnlyField(source='bodega.nombre')
+    subbodega_nombre = serializers.ReadOnlyField(source='subbodega.full_path', default=None)
+    bodega_destino_nombre = serializers.ReadOnlyField(source='bodega_destino.nombre', default=None)
+    subbodega_destino_nombre = serializers.ReadOnlyField(source='subbodega_destino.full_path', default=None)
+    marca_nombre = serializers.ReadOnlyField(source='marca.nombre', default=None)
+    factura_numero = serializers.ReadOnlyField(source='factura.numero', default=None)
+    usuario_nombre = serializers.ReadOnlyField(source='usuario.username', default=None)
+
+    expandable_fields = {
+        'material': MaterialSerializer,
+        'bodega': BodegaResumenSerializer,
+        'subbodega': SubbodegaSimpleSerializer,
+        'bodega_destino': BodegaResumenSerializer,
+        'subbodega_destino': SubbodegaSimpleSerializer,
+        'factura': FacturaSerializer,
+        'marca': MarcaSerializer,
+        'usuario': UsuarioSerializer,
+    }
+
+    class Meta:
+        model = Movimiento
+        fields = [
+            'id', 'fecha', 'tipo', 'cantidad',
+            'material', 'material_codigo', 'material_nombre', 'material_unidad',
+            'bodega', 'bodega_nombre', 'subbodega', 'subbodega_nombre',
+            'bodega_destino', 'bodega_destino_nombre', 'subbodega_destino', 'subbodega_destino_nombre',
+            'marca', 'marca_nombre', 'factura', 'factura_numero', 'factura_manual',
+            'observaciones', 'usuario', 'usuario_nombre'
+        ]
+
+    def get_fields(self):
+        # Expanded objects are explicitly requested, so ?fields= does not drop them
+        fields = super().get_fields()
+        for name in self.get_expand():
+            fields[f"{name}_info"] = self.expandable_fields[name](source=name, read_only=True)
+        return fields
+
+    def get_expand(self):
+        request = self.context.get('request')
+        if request is None:
+            return []
+        requested = request.query_params.get('expand', '')
+        return [name for name in requested.split(',') if name in self.expandable_fields]
+
+class MovimientoBulkListSerializer(serializers.ListSerializer):
+    """Resolves the related ids of the whole batch with one query per model."""
+    relaciones = {
+        'material': Material,
+        'bodega': Bodega,
+        'subbodega': Subbodega,
+        'bodega_destino': Bodega,
+        'subbodega_destino': Subbodega,
+        'marca': Marca,
+        'factura': Factura,
+    }
+
+    def to_internal_value(self, data):
+        # Errors are raised here rather than in validate() so they stay a list
+        # aligned with the input lines.
+        lines = super().to_internal_value(data)
+        ids_por_modelo = {}
+        for line in lines:
+            for field, model in self.relaciones.items():
+                if line.get(field) is not None:
+                    ids_por_modelo.setdefault(model, set()).add(line[field])
+        objetos = {model: model.objects.in_bulk(ids) for model, ids in ids_por_modelo.items()}
+
+        errors = []
+        for line in lines:
+            line_errors = {}
+            for field, model in self.relaciones.items():
+                pk = line.get(field)
+                if pk is None:
+                    continue
+                obj = objetos[model].get(pk)
+                if obj is None:
+                    line_errors[field] = [f"No existe {field} con id {pk}."]
+                line[field] = obj
+
+            if not line_errors and line.get('tipo') == 'Traslado':
+                try:
+                    validar_traslado(line['bodega'], line.get('subbodega'), line.get('bodega_destino'), line.get('subbodega_destino'))
+                except serializers.ValidationError as exc:
+                    line_errors = serializers.as_serializer_error(exc)
+            errors.append(line_errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return lines
+
+class MovimientoBulkItemSerializer(serializers.Serializer):
+    """One line of movimientos/bulk. Related objects are sent as ids."""
+    tipo = serializers.ChoiceField(choices=Movimiento.TIPO_MOVIMIENTO)
+    material = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=1)
+    bodega = serializers.IntegerField()
+    subbodega = serializers.IntegerField(required=False, allow_null=True)
+    bodega_destino = serializers.IntegerField(required=False, allow_null=True)
+    subbodega_destino = serializers.IntegerField(required=False, allow_null=True)
+    marca = serializers.IntegerField(required=False, allow_null=True)
+    factura = serializers.IntegerField(required=False, allow_null=True)
+    factura_manual = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
+    fecha = serializers.DateTimeField(required=False)
+    observaciones = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+    class Meta:
+        list_serializer_class = MovimientoBulkListSerializer
+
+class DisponibilidadListSerializer(MovimientoBulkListSerializer):
+    """Resolves the ids of a picking list with one query per model, like the movement batches."""
+    relaciones = {
+        'material': Material,
+        'bodega': Bodega,
+        'subbodega': Subbodega,
+    }
+
+class DisponibilidadItemSerializer(serializers.Serializer):
+    """One line of movimientos/disponibilidad: a quantity to take out of one location."""
+    material = serializers.IntegerField()
+    bodega = serializers.IntegerField()
+    subbodega = serializers.IntegerField(required=False, allow_null=True)
+    cantidad = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        list_serializer_class = DisponibilidadListSerializer
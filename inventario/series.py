@@ -0,0 +1,123 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from .models import Movimiento, ResumenMovimiento
+
+# Bucket sizes for reportes/series, all computed from the daily rollups
+PERIODOS = {
+    'dia': lambda: F('dia'),
+    'semana': lambda: TruncWeek('dia'),
+    'mes': lambda: TruncMonth('dia'),
+}
+# Optional split of each series, with the columns returned for it
+AGRUPACIONES = {
+    'material': ['material', 'material__codigo', 'material__nombre'],
+    'bodega': ['bodega', 'bodega__nombre'],
+    'marca': ['marca', 'marca__nombre'],
+}
+
+
+def rollup_key(mov):
+    fecha = timezone.localtime(mov.fecha) if timezone.is_aware(mov.fecha) else mov.fecha
+    return (
+        fecha.date(), mov.material_id, mov.bodega_id, mov.subbodega_id,
+        mov.bodega_destino_id, mov.subbodega_destino_id, mov.marca_id, mov.tipo
+    )
+
+
+def rollup_deltas(mov, sign=1):
+    """[(key, cantidad, count)] contributed by a movement; sign=-1 reverts it."""
+    return [(rollup_key(mov), sign * mov.cantidad, sign)]
+
+
+def apply_rollup_deltas(deltas, create_missing=True):
+    """
+    Adds the deltas to the daily rollups. Each key is updated on one row by pk,
+    so keys that ended up with several rows (see ResumenMovimiento) stay exact.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for key, cantidad, count in deltas:
+        totals[key][0] += cantidad
+        totals[key][1] += count
+
+    with transaction.atomic():
+        for (dia, material_id, bodega_id, subbodega_id, destino_id, subdestino_id, marca_id, tipo), (cantidad, count) in totals.items():
+            if not cantidad and not count:
+                continue
+            key = dict(
+                dia=dia, material_id=material_id, bodega_id=bodega_id, subbodega_id=subbodega_id,
+                bodega_destino_id=destino_id, subbodega_destino_id=subdestino_id, marca_id=marca_id, tipo=tipo
+            )
+            pk = ResumenMovimiento.objects.filter(**key).values_list('pk', flat=True).first()
+            if pk is not None:
+                ResumenMovimiento.objects.filter(pk=pk).update(
+                    cantidad=F('cantidad') + cantidad, movimientos=F('movimientos') + count
+                )
+            elif create_missing:
+                ResumenMovimiento.objects.create(cantidad=cantidad, movimientos=count, **key)
+
+
+def apply_rollups(movimientos, sign=1):
+    """Registers (sign=1) or reverts (sign=-1) a batch of movements in the rollups."""
+    deltas = []
+    for mov in movimientos:
+        deltas.extend(rollup_deltas(mov, sign))
+    apply_rollup_deltas(deltas, create_missing=sign > 0)
+
+
+def rebuild_rollups():
+    """Recomputes every daily rollup row from the movement history."""
+    rows = (
+        Movimiento.objects.annotate(dia=TruncDate('fecha'))
+        .values('dia', 'material', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino', 'marca', 'tipo')
+        .annotate(total=Sum('cantidad'), n=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        ResumenMovimiento.objects.all().delete()
+        ResumenMovimiento.objects.bulk_create(
+            (
+                ResumenMovimiento(
+                    dia=r['dia'], material_id=r['material'], bodega_id=r['bodega'], subbodega_id=r['subbodega'],
+                    bodega_destino_id=r['bodega_destino'], subbodega_destino_id=r['subbodega_destino'],
+                    marca_id=r['marca'], tipo=r['tipo'], cantidad=r['total'] or 0, movimientos=r['n']
+                )
+                for r in rows.iterator()
+            ),
+            batch_size=1000
+        )
+    return ResumenMovimiento.objects.count()
+
+
+def movement_series(periodo='dia', desde=None, hasta=None, tipos=None, agrupar=None, **filtros):
+    """
+    Summed cantidad and movement count per bucket and tipo (and per material,
+    origin bodega or marca with agrupar), read from the daily rollups. filtros
+    are material, bodega, subbodega and marca ids; as in the kardex, a bodega
+    or subbodega matches the origin or the destination of a Traslado.
+    """
+    rollups = ResumenMovimiento.objects.all()
+    if desde:
+        rollups = rollups.filter(dia__gte=desde)
+    if hasta:
+        rollups = rollups.filter(dia__lte=hasta)
+    if tipos:
+        rollups = rollups.filter(tipo__in=tipos)
+    for campo, valor in filtros.items():
+        if valor is None:
+            continue
+        if campo in ('bodega', 'subbodega'):
+            rollups = rollups.filter(Q(**{f"{campo}_id": valor}) | Q(**{f"{campo}_destino_id": valor}))
+        else:
+            rollups = rollups.filter(**{f"{campo}_id": valor})
+
+    columnas = ['periodo', 'tipo'] + AGRUPACIONES.get(agrupar, [])
+    return list(
+        rollups.annotate(periodo=PERIODOS[periodo]())
+        .values(*columnas)
+        .annotate(total_cantidad=Sum('cantidad'), total_movimientos=Sum('movimientos'))
+        .filter(total_movimientos__gt=0)
+        .order_by(*columnas)
+    )
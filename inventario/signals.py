@@ -0,0 +1,140 @@
+from django.db import connections, transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, post_migrate
+from django.dispatch import receiver
+from .models import Bodega, Marca, Material, Movimiento, Subbodega, SaldoInventario, UnidadMedida, UmbralStock
+from .stock import movement_deltas, apply_movements, apply_stock_deltas, record_entries
+from .series import rollup_deltas, apply_rollup_deltas, apply_rollups
+from .busqueda import FTS_TABLE, ensure_search_index, invalidate_all_barcodes, invalidate_barcodes
+from .versiones import bump_catalog_versions
+from .reportes import invalidate_reports
+from .alertas import evaluate_material_alerts
+from .cierres import invalidate_closings
+
+
+@receiver(pre_save, sender=Movimiento)
+def movimiento_pre_save(sender, instance, raw=False, **kwargs):
+    # Keep the stored version so post_save can revert its effect on the balances
+    instance._stock_previo = None
+    if not raw and instance.pk and not instance._state.adding:
+        instance._stock_previo = Movimiento.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Movimiento)
+def movimiento_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = movement_deltas(instance)
+    resumen = rollup_deltas(instance)
+    desde = instance.fecha
+    previo = getattr(instance, '_stock_previo', None)
+    if previo is not None:
+        deltas.extend(movement_deltas(previo, sign=-1))
+        resumen.extend(rollup_deltas(previo, sign=-1))
+        desde = min(desde, previo.fecha)
+    apply_stock_deltas(deltas)
+    apply_rollup_deltas(resumen)
+    record_entries([instance], replace=not created)
+    # Closings taken after the movement no longer match the history
+    invalidate_closings(desde)
+
+
+@receiver(post_delete, sender=Movimiento)
+def movimiento_post_delete(sender, instance, **kwargs):
+    apply_stock_deltas(movement_deltas(instance, sign=-1), create_missing=False)
+    apply_rollup_deltas(rollup_deltas(instance, sign=-1), create_missing=False)
+    invalidate_closings(instance.fecha)
+
+
+def register_bulk_movements(movimientos):
+    """
+    What the Movimiento signals do on save, for movements inserted with
+    bulk_create (which skips them): balances, rollups, ledger entries, the
+    closings they predate and the cached reports. Call inside the transaction.
+    """
+    if not movimientos:
+        return
+    apply_movements(movimientos)
+    apply_rollups(movimientos)
+    record_entries(movimientos)
+    invalidate_closings(min(mov.fecha for mov in movimientos))
+    transaction.on_commit(invalidate_reports)
+
+
+@receiver(pre_delete, sender=Subbodega)
+def subbodega_pre_delete(sender, instance, **kwargs):
+    # Movements keep their stock when a subbodega is removed (SET_NULL), so it
+    # moves to the "General" location of the same bodega. This runs after commit
+    # because the whole bodega may be going away in the same delete.
+    saldos = list(SaldoInventario.objects.filter(subbodega=instance).values_list('material_id', 'bodega_id', 'cantidad'))
+    if not saldos:
+        return
+
+    def merge_into_general():
+        vivas = set(Bodega.objects.filter(id__in={b for _, b, _ in saldos}).values_list('id', flat=True))
+        apply_stock_deltas([((m, b, None), q) for m, b, q in saldos if b in vivas])
+
+    transaction.on_commit(merge_into_general)
+
+
+@receiver(pre_save, sender=Material)
+def material_pre_save(sender, instance, raw=False, **kwargs):
+    instance._codigo_barras_previo = None
+    if not raw and instance.pk and not instance._state.adding:
+        instance._codigo_barras_previo = (
+            Material.objects.filter(pk=instance.pk).values_list('codigo_barras', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Material)
+def material_post_save(sender, instance, **kwargs):
+    codigos = (instance.codigo_barras, getattr(instance, '_codigo_barras_previo', None))
+    transaction.on_commit(lambda: invalidate_barcodes(*codigos))
+
+
+@receiver(post_delete, sender=Material)
+def material_post_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_barcodes(instance.codigo_barras))
+
+
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+def marca_changed(sender, **kwargs):
+    # Cached barcode lookups carry marca_nombre, the reports group by marca
+    transaction.on_commit(invalidate_all_barcodes)
+    transaction.on_commit(invalidate_reports)
+
+
+@receiver(post_save, sender=Movimiento)
+@receiver(post_delete, sender=Movimiento)
+def movimiento_changed(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(invalidate_reports)
+
+
+def catalogo_changed(sender, raw=False, **kwargs):
+    # Version stamps behind the ETag of the catalog endpoints
+    if not raw:
+        bump_catalog_versions(sender._meta.model_name)
+
+
+for _catalogo in (Material, Marca, UnidadMedida, Bodega, Subbodega):
+    post_save.connect(catalogo_changed, sender=_catalogo, dispatch_uid=f"catalogo_save_{_catalogo.__name__}")
+    post_delete.connect(catalogo_changed, sender=_catalogo, dispatch_uid=f"catalogo_delete_{_catalogo.__name__}")
+
+
+@receiver(post_save, sender=UmbralStock)
+@receiver(post_delete, sender=UmbralStock)
+def umbral_changed(sender, instance, raw=False, **kwargs):
+    # After commit: a cascade from Material or Bodega may be removing the alerts' rows too
+    if not raw:
+        material_id = instance.material_id
+        transaction.on_commit(lambda: evaluate_material_alerts(material_id))
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    # SQLite drops the FTS triggers when a migration rebuilds inventario_material
+    connection = connections[using]
+    if sender.name == 'inventario' and connection.vendor == 'sqlite' \
+            and FTS_TABLE in connection.introspection.table_names():
+        ensure_search_index(connection)
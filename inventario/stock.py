@@ -0,0 +1,239 @@
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Sum, F, Q
+from .models import AsientoStock, CierreInventario, Movimiento, SaldoInventario
+from .alertas import evaluate_alerts, rebuild_alerts
+
+# Sign rules for each movement type, as seen from the origin location
+TIPOS_ENTRADA = ['Entrada', 'Edicion', 'Ajuste', 'Devolucion']
+TIPOS_SALIDA = ['Salida', 'Traslado']
+
+
+def movement_deltas(mov, sign=1):
+    """
+    Returns the stock changes caused by a movement as a list of
+    ((material_id, bodega_id, subbodega_id), delta). A Traslado affects
+    two locations: it leaves the origin and arrives at the destination.
+    """
+    origen = (mov.material_id, mov.bodega_id, mov.subbodega_id)
+    if mov.tipo in TIPOS_ENTRADA:
+        return [(origen, sign * mov.cantidad)]
+    if mov.tipo == 'Salida':
+        return [(origen, -sign * mov.cantidad)]
+    if mov.tipo == 'Traslado':
+        deltas = [(origen, -sign * mov.cantidad)]
+        if mov.bodega_destino_id:
+            destino = (mov.material_id, mov.bodega_destino_id, mov.subbodega_destino_id)
+            deltas.append((destino, sign * mov.cantidad))
+        return deltas
+    return []
+
+
+def apply_stock_deltas(deltas, create_missing=True):
+    """
+    Adds the given deltas to the balance rows. Missing rows are created unless
+    create_missing is False, which is used when reverting deleted movements
+    (their rows may have been removed by a cascade on material or bodega).
+    """
+    totals = defaultdict(int)
+    for key, delta in deltas:
+        totals[key] += delta
+
+    with transaction.atomic():
+        for (material_id, bodega_id, subbodega_id), delta in totals.items():
+            if delta == 0:
+                continue
+            saldo = SaldoInventario.objects.filter(
+                material_id=material_id, bodega_id=bodega_id, subbodega_id=subbodega_id
+            )
+            updated = saldo.update(cantidad=F('cantidad') + delta)
+            if not updated and create_missing:
+                # A concurrent first write may insert the same row: insert a zero
+                # balance unless it exists, then add the delta to whichever row won
+                SaldoInventario.objects.bulk_create(
+                    [SaldoInventario(material_id=material_id, bodega_id=bodega_id, subbodega_id=subbodega_id)],
+                    ignore_conflicts=True
+                )
+                saldo.update(cantidad=F('cantidad') + delta)
+
+        # Low-stock alerts follow the bodega totals that just changed
+        evaluate_alerts({(material_id, bodega_id) for (material_id, bodega_id, _), delta in totals.items() if delta})
+
+
+def apply_movements(movimientos, sign=1):
+    """Registers (sign=1) or reverts (sign=-1) a batch of movements in the balances."""
+    deltas = []
+    for mov in movimientos:
+        deltas.extend(movement_deltas(mov, sign))
+    apply_stock_deltas(deltas, create_missing=sign > 0)
+
+
+def available_stock(material_id, bodega_id, subbodega_id, lock=False):
+    """
+    Current stock at one exact location, read from its balance row. With
+    lock=True the row is locked (SELECT ... FOR UPDATE) until the surrounding
+    transaction ends, so concurrent dispatches on the same location serialize.
+    """
+    saldos = SaldoInventario.objects.filter(
+        material_id=material_id, bodega_id=bodega_id, subbodega_id=subbodega_id
+    )
+    if lock:
+        saldos = saldos.select_for_update()
+    return saldos.values_list('cantidad', flat=True).first() or 0
+
+
+def stock_levels(keys, lock=False):
+    """
+    Current stock for a set of (material_id, bodega_id, subbodega_id) keys in a
+    single query. Keys without a balance row get 0.
+    """
+    levels = defaultdict(int)
+    keys = set(keys)
+    if not keys:
+        return levels
+    condition = reduce(or_, (Q(material_id=m, bodega_id=b, subbodega_id=s) for m, b, s in keys))
+    saldos = SaldoInventario.objects.filter(condition)
+    if lock:
+        saldos = saldos.select_for_update()
+    for m, b, s, cantidad in saldos.values_list('material_id', 'bodega_id', 'subbodega_id', 'cantidad'):
+        levels[(m, b, s)] = cantidad
+    return levels
+
+
+def check_batch_stock(movimientos, lock=True):
+    """
+    Validates Salida/Traslado stock for a batch of unsaved movements, in order,
+    so earlier lines of the batch count for later ones. Returns a dict
+    {index: available} for every line that would overdraw its origin.
+    """
+    keys = {
+        (mov.material_id, mov.bodega_id, mov.subbodega_id)
+        for mov in movimientos if mov.tipo in TIPOS_SALIDA
+    }
+    running = stock_levels(keys, lock=lock)
+    shortages = {}
+    for index, mov in enumerate(movimientos):
+        if mov.tipo in TIPOS_SALIDA:
+            origen = (mov.material_id, mov.bodega_id, mov.subbodega_id)
+            if mov.cantidad > running[origen]:
+                shortages[index] = running[origen]
+                continue
+        for key, delta in movement_deltas(mov):
+            running[key] += delta
+    return shortages
+
+
+def check_availability(lineas):
+    """
+    [(disponible, faltante)] for (material_id, bodega_id, subbodega_id, cantidad)
+    lines to take out, with the rules of a Salida: stock at the exact location,
+    read in one query, and lines that fit consume it for later lines on the same
+    location (as in check_batch_stock).
+    """
+    running = stock_levels({linea[:3] for linea in lineas})
+    resultado = []
+    for material_id, bodega_id, subbodega_id, cantidad in lineas:
+        key = (material_id, bodega_id, subbodega_id)
+        disponible = running[key]
+        faltante = max(cantidad - disponible, 0)
+        if not faltante:
+            running[key] -= cantidad
+        resultado.append((disponible, faltante))
+    return resultado
+
+
+def count_materials_by_bodega(bodega_ids):
+    """Number of materials with positive stock per bodega, in one grouped query."""
+    rows = (
+        SaldoInventario.objects.filter(bodega_id__in=bodega_ids)
+        .values('bodega', 'material')
+        .annotate(stock=Sum('cantidad'))
+        .filter(stock__gt=0)
+        .values_list('bodega', flat=True)
+    )
+    return Counter(rows)
+
+
+def record_entries(movimientos, replace=False):
+    """
+    Writes the ledger entries (AsientoStock) of saved movements, one per
+    location in movement_deltas. replace=True first drops the entries the
+    movements already had (after an edit).
+    """
+    movimientos = list(movimientos)
+    if replace:
+        AsientoStock.objects.filter(movimiento_id__in=[mov.id for mov in movimientos]).delete()
+    AsientoStock.objects.bulk_create(
+        [
+            AsientoStock(
+                movimiento_id=mov.id, material_id=material_id, bodega_id=bodega_id,
+                subbodega_id=subbodega_id, fecha=mov.fecha, delta=delta
+            )
+            for mov in movimientos
+            for (material_id, bodega_id, subbodega_id), delta in movement_deltas(mov)
+        ],
+        batch_size=1000
+    )
+
+
+def rebuild_ledger():
+    """Rewrites every ledger entry from the movement history."""
+    with transaction.atomic():
+        AsientoStock.objects.all().delete()
+        movimientos = Movimiento.objects.only(
+            'id', 'tipo', 'cantidad', 'fecha', 'material', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino'
+        ).order_by()
+        batch = []
+        for mov in movimientos.iterator(chunk_size=2000):
+            batch.append(mov)
+            if len(batch) >= 2000:
+                record_entries(batch)
+                batch = []
+        record_entries(batch)
+    return AsientoStock.objects.count()
+
+
+def aggregate_stock(asientos=None, bodega_id=None):
+    """
+    SUM(delta) per location over the ledger (or the given AsientoStock
+    queryset, e.g. a fecha range), keyed like SaldoInventario.
+    """
+    if asientos is None:
+        asientos = AsientoStock.objects.all()
+    if bodega_id is not None:
+        asientos = asientos.filter(bodega_id=bodega_id)
+    inventory = defaultdict(int)
+    for m, b, s, q in asientos.values_list('material', 'bodega', 'subbodega').annotate(q=Sum('delta')).order_by():
+        inventory[(m, b, s)] += q or 0
+    return inventory
+
+
+def rebuild_stock_balances(desde_cierre=True):
+    """
+    Recomputes every balance row from the ledger: from the latest vigente
+    closing plus the entries since, or from the whole ledger with
+    desde_cierre=False. Rows that net to zero are kept so that reverting a
+    deleted movement always finds its row.
+    """
+    cierre = CierreInventario.objects.filter(vigente=True).order_by('-fecha').first() if desde_cierre else None
+    if cierre is None:
+        inventory = aggregate_stock()
+    else:
+        inventory = defaultdict(int)
+        for m, b, s, qty in cierre.saldos.values_list('material_id', 'bodega_id', 'subbodega_id', 'cantidad'):
+            inventory[(m, b, s)] += qty
+        for key, qty in aggregate_stock(AsientoStock.objects.filter(fecha__gte=cierre.fecha)).items():
+            inventory[key] += qty
+    with transaction.atomic():
+        SaldoInventario.objects.all().delete()
+        SaldoInventario.objects.bulk_create(
+            [
+                SaldoInventario(material_id=m, bodega_id=b, subbodega_id=s, cantidad=qty)
+                for (m, b, s), qty in inventory.items()
+            ],
+            batch_size=1000
+        )
+        rebuild_alerts()
+    return SaldoInventario.objects.count()
@@ -0,0 +1,115 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files import File
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from .models import TareaReporte
+from .utils import export_all_data_to_excel, import_all_data_from_excel
+
+# In-process pool: request workers hand jobs over and return immediately.
+# Job state lives in TareaReporte, so any worker process can answer the polls.
+# Progress also goes to the 'tareas' cache, shared between processes: an
+# import runs in one transaction and its row updates stay invisible until it
+# commits. The cache entry doubles as the heartbeat of a running job.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def progress_cache_key(tarea_id):
+    return f"tarea-reporte:{tarea_id}:progreso"
+
+
+def _publish_progress(tarea_id, progreso):
+    caches['tareas'].set(progress_cache_key(tarea_id), progreso, timeout=settings.TAREAS_TIMEOUT)
+
+
+def job_progress(tarea):
+    """Rows processed per sheet: live from the cache while the job runs."""
+    if tarea.estado == 'en_proceso':
+        return caches['tareas'].get(progress_cache_key(tarea.pk)) or tarea.progreso
+    return tarea.progreso
+
+
+def expire_stale_jobs():
+    """
+    Marks as failed the pending or running jobs with no progress for
+    TAREAS_TIMEOUT seconds, e.g. because the process running them died.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.TAREAS_TIMEOUT)
+    candidatas = TareaReporte.objects.filter(estado__in=['pendiente', 'en_proceso'], actualizado__lt=limite)
+    pks = list(candidatas.values_list('pk', flat=True))
+    if not pks:
+        return 0
+    vivas = caches['tareas'].get_many([progress_cache_key(pk) for pk in pks])
+    muertas = [pk for pk in pks if progress_cache_key(pk) not in vivas]
+    ahora = timezone.now()
+    return candidatas.filter(pk__in=muertas).update(
+        estado='error', error="La tarea se interrumpió: el proceso que la ejecutaba se detuvo.",
+        finalizado=ahora, actualizado=ahora
+    )
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TAREAS_MAX_WORKERS', 2),
+                thread_name_prefix='tareas-reporte'
+            )
+        return _executor
+
+
+def submit_import(archivo, user=None):
+    tarea = TareaReporte(tipo='importacion', usuario=user)
+    tarea.archivo.save(archivo.name, archivo, save=False)
+    tarea.save()
+    _get_executor().submit(_run, tarea.pk)
+    return tarea
+
+
+def submit_export(user=None, template=False):
+    tarea = TareaReporte.objects.create(tipo='plantilla' if template else 'exportacion', usuario=user)
+    _get_executor().submit(_run, tarea.pk)
+    return tarea
+
+
+def _run(tarea_id):
+    close_old_connections()
+    try:
+        tarea = TareaReporte.objects.get(pk=tarea_id)
+        TareaReporte.objects.filter(pk=tarea_id).update(estado='en_proceso', actualizado=timezone.now())
+        progreso = {}
+        _publish_progress(tarea_id, progreso)
+
+        def progress(sheet_name, rows_done):
+            progreso[sheet_name] = rows_done
+            _publish_progress(tarea_id, progreso)
+            if not connection.in_atomic_block:
+                TareaReporte.objects.filter(pk=tarea_id).update(progreso=progreso, actualizado=timezone.now())
+
+        if tarea.tipo == 'importacion':
+            with tarea.archivo.open('rb') as excel_file:
+                resultado = import_all_data_from_excel(excel_file, user=tarea.usuario, progress=progress)
+            tarea.resultado = resultado
+        else:
+            excel_file = export_all_data_to_excel(template=tarea.tipo == 'plantilla', progress=progress)
+            nombre = 'plantilla_inventario.xlsx' if tarea.tipo == 'plantilla' else 'backup_inventario.xlsx'
+            with excel_file:
+                tarea.archivo.save(nombre, File(excel_file), save=False)
+            tarea.resultado = {'filas': progreso}
+
+        tarea.progreso = progreso
+        tarea.estado = 'completada'
+        tarea.finalizado = timezone.now()
+        tarea.save()
+    except Exception as e:
+        TareaReporte.objects.filter(pk=tarea_id).update(
+            estado='error', error=str(e), finalizado=timezone.now(), actualizado=timezone.now()
+        )
+    finally:
+        caches['tareas'].delete(progress_cache_key(tarea_id))
+        connection.close()
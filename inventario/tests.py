@@ -1,3 +1,391 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+import openpyxl
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from .cierres import create_closing, refresh_closings, stock_as_of
+from .models import (
+    AlertaStock, Bodega, Marca, Material, Movimiento, SaldoCierre, SaldoInventario, Subbodega, TareaReporte,
+    UmbralStock
+)
+from .series import movement_series
+from .stock import apply_stock_deltas, rebuild_stock_balances
+from .tareas import progress_cache_key
+from .utils import import_all_data_from_excel
+from .views import MovimientoViewSet
+from usuarios.models import Usuario
 
-# Create your tests here.
+
+# In-memory caches, so no test reads results cached by an earlier run
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default-tests'},
+    'tareas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tareas-tests'},
+})
+class InventarioTestCase(TestCase):
+    """Two bodegas with one subbodega each, a material with a brand and an authenticated client."""
+
+    def tearDown(self):
+        caches['default'].clear()
+        caches['tareas'].clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create_user(username='operario', password='clave')
+        cls.bodega = Bodega.objects.create(nombre="Principal")
+        cls.bodega2 = Bodega.objects.create(nombre="Secundaria")
+        cls.estante = Subbodega.objects.create(nombre="Estante", bodega=cls.bodega)
+        cls.estante2 = Subbodega.objects.create(nombre="Estante", bodega=cls.bodega2)
+        cls.marca = Marca.objects.create(nombre="Acme")
+        cls.marca2 = Marca.objects.create(nombre="Otra")
+        cls.material = Material.objects.create(codigo="M-1", nombre="Tornillo", unidad="pcs", marca=cls.marca)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def entrada(self, cantidad, bodega=None, subbodega=None, **extra):
+        return Movimiento.objects.create(
+            tipo='Entrada', material=self.material, cantidad=cantidad,
+            bodega=bodega or self.bodega, subbodega=subbodega, **extra
+        )
+
+    def saldo(self, bodega=None, subbodega=None):
+        saldo = SaldoInventario.objects.filter(
+            material=self.material, bodega=bodega or self.bodega, subbodega=subbodega
+        ).first()
+        return saldo.cantidad if saldo else 0
+
+
+class MovimientoBulkTests(InventarioTestCase):
+    url = '/api/movimientos/bulk/'
+
+    def line(self, tipo, cantidad, **extra):
+        return {'tipo': tipo, 'material': self.material.id, 'cantidad': cantidad, 'bodega': self.bodega.id, **extra}
+
+    def test_rejects_non_positive_quantities(self):
+        self.entrada(10)
+        for cantidad in (-50, 0):
+            response = self.client.post(self.url, [self.line('Salida', cantidad)], format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('cantidad', response.data[0])
+        self.assertEqual(self.saldo(), 10)
+        self.assertEqual(Movimiento.objects.count(), 1)
+
+    def test_earlier_lines_count_for_later_ones(self):
+        self.entrada(10)
+        lines = [self.line('Salida', 6), self.line('Salida', 6)]
+        response = self.client.post(self.url, lines, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('Disponible: 4', str(response.data[1]))
+        self.assertEqual(self.saldo(), 10)
+
+        lines = [self.line('Entrada', 2), self.line('Salida', 6), self.line('Salida', 6)]
+        response = self.client.post(self.url, lines, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.saldo(), 0)
+
+    def test_errors_are_aligned_with_input_lines(self):
+        lines = [
+            self.line('Entrada', 5),
+            self.line('Entrada', 5, bodega=999999),
+            self.line('Entrada', 5),
+            self.line('Traslado', 5),
+        ]
+        response = self.client.post(self.url, lines, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('bodega', response.data[1])
+        self.assertEqual(response.data[2], {})
+        self.assertTrue(response.data[3])
+        self.assertFalse(Movimiento.objects.exists())
+
+    def test_marca_rules(self):
+        lines = [self.line('Entrada', 5, marca=self.marca2.id), self.line('Salida', 2)]
+        response = self.client.post(self.url, lines, format='json')
+        self.assertEqual(response.status_code, 201)
+        entrada, salida = Movimiento.objects.filter(id__in=response.data['ids']).order_by('id')
+        self.material.refresh_from_db()
+        # An Entrada with a brand sets the material's brand, a Salida without one inherits it
+        self.assertEqual(self.material.marca, self.marca2)
+        self.assertEqual(entrada.marca, self.marca2)
+        self.assertEqual(salida.marca, self.marca2)
+        self.assertEqual(self.saldo(), 3)
+
+
+class SaldoConcurrenteTests(InventarioTestCase):
+    """First writes to a new location when another operator inserts the same row in between."""
+
+    def race(self, model, **fila):
+        # The UPDATE matches nothing, then the other writer's row appears before our INSERT
+        original = QuerySet.update
+        state = {'raced': False}
+
+        def update(queryset, **kwargs):
+            if queryset.model is model and not state['raced']:
+                state['raced'] = True
+                model.objects.create(**fila)
+                return 0
+            return original(queryset, **kwargs)
+        return mock.patch.object(QuerySet, 'update', update)
+
+    def test_first_balance_write_keeps_both_deltas(self):
+        with self.race(SaldoInventario, material=self.material, bodega=self.bodega, subbodega=self.estante, cantidad=7):
+            apply_stock_deltas([((self.material.id, self.bodega.id, self.estante.id), 5)])
+        self.assertEqual(self.saldo(subbodega=self.estante), 12)
+        with self.race(SaldoInventario, material=self.material, bodega=self.bodega, cantidad=3):
+            apply_stock_deltas([((self.material.id, self.bodega.id, None), 4)])
+        self.assertEqual(self.saldo(), 7)
+
+    def test_alert_raised_concurrently_is_updated(self):
+        UmbralStock.objects.create(material=self.material, minimo=5, reorden=10)
+        otra = AlertaStock(material=self.material, bodega=self.bodega, nivel='reorden', cantidad=9, minimo=5, reorden=10)
+        original = AlertaStock.objects.filter
+
+        def filter(*args, **kwargs):
+            # The alert rows are read before the other writer commits its alert
+            if otra.pk is None and args:
+                otra.save()
+                return AlertaStock.objects.none()
+            return original(*args, **kwargs)
+
+        with mock.patch.object(AlertaStock.objects, 'filter', filter):
+            self.entrada(3)
+        alerta = AlertaStock.objects.get(material=self.material, bodega=self.bodega)
+        self.assertEqual((alerta.nivel, alerta.cantidad), ('minimo', 3))
+
+
+class MovimientoFiltrosTests(InventarioTestCase):
+    url = '/api/movimientos/'
+
+    def ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return {row['id'] for row in response.data['results']}
+
+    def list_queryset(self, **params):
+        request = Request(APIRequestFactory().get(self.url, params))
+        return MovimientoViewSet(action='list', request=request, format_kwarg=None).get_queryset()
+
+    def test_bare_fecha_hasta_includes_the_whole_day(self):
+        dia = datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+        antes = self.entrada(1, fecha=dia - timedelta(seconds=1))
+        inicio = self.entrada(1, fecha=dia)
+        fin = self.entrada(1, fecha=dia + timedelta(hours=23, minutes=59))
+        self.entrada(1, fecha=dia + timedelta(days=1))
+        self.assertEqual(self.ids(fecha_desde='2024-03-10', fecha_hasta='2024-03-10'), {inicio.id, fin.id})
+        self.assertEqual(self.ids(fecha_hasta='2024-03-09'), {antes.id})
+        # An explicit time is inclusive
+        self.assertEqual(self.ids(fecha_desde='2024-03-10T12:00', fecha_hasta='2024-03-10T23:59'), {fin.id})
+
+    def test_tipo_list(self):
+        entrada = self.entrada(10)
+        salida = Movimiento.objects.create(tipo='Salida', material=self.material, cantidad=2, bodega=self.bodega)
+        ajuste = Movimiento.objects.create(tipo='Ajuste', material=self.material, cantidad=1, bodega=self.bodega)
+        self.assertEqual(self.ids(tipo='Entrada,Salida'), {entrada.id, salida.id})
+        self.assertEqual(self.ids(tipo='Ajuste'), {ajuste.id})
+
+    def test_location_matches_origin_or_destination(self):
+        entrada = self.entrada(10, subbodega=self.estante)
+        traslado = Movimiento.objects.create(
+            tipo='Traslado', material=self.material, cantidad=4, bodega=self.bodega, subbodega=self.estante,
+            bodega_destino=self.bodega2, subbodega_destino=self.estante2
+        )
+        otra = self.entrada(3, bodega=self.bodega2)
+        self.assertEqual(self.ids(bodega=self.bodega.id), {entrada.id, traslado.id})
+        self.assertEqual(self.ids(bodega=self.bodega2.id), {traslado.id, otra.id})
+        self.assertEqual(self.ids(subbodega=self.estante.id), {entrada.id, traslado.id})
+        self.assertEqual(self.ids(subbodega=self.estante2.id), {traslado.id})
+
+    def test_malformed_values_return_400(self):
+        for params in ({'material': 'abc'}, {'bodega': '1x'}, {'subbodega': 'x'}, {'fecha_desde': '2024-13-01'}, {'fecha_hasta': 'ayer'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(next(iter(params)), response.data)
+
+    @skipUnless(connection.vendor == 'sqlite', "Plans asserted for SQLite")
+    def test_filters_use_composite_indexes(self):
+        casos = [
+            ({'material': self.material.id}, 'mov_material_fecha_idx'),
+            ({'bodega': self.bodega.id}, 'mov_bodega_fecha_idx'),
+            ({'tipo': 'Salida', 'fecha_desde': '2024-01-01'}, 'mov_tipo_fecha_idx'),
+        ]
+        for params, index in casos:
+            plan = self.list_queryset(**params).explain()
+            self.assertIn(f"inventario_movimiento USING INDEX {index}", plan, params)
+
+
+class ImportMovimientosTests(InventarioTestCase):
+
+    def workbook(self, *filas):
+        wb = openpyxl.Workbook()
+        hoja = wb.active
+        hoja.title = "Movimientos"
+        hoja.append(['ID', 'Fecha', 'Tipo', 'Material', 'Cantidad', 'Bodega', 'Subbodega'])
+        for fila in filas:
+            hoja.append(fila)
+        archivo = BytesIO()
+        wb.save(archivo)
+        archivo.seek(0)
+        return archivo
+
+    def test_repeated_new_id_keeps_the_last_row(self):
+        material = f"{self.material.codigo} - {self.material.nombre}"
+        archivo = self.workbook(
+            [900, '2024-03-10T08:00:00', 'Entrada', material, 5, self.bodega.nombre, None],
+            [900, '2024-03-11T08:00:00', 'Entrada', material, 8, self.bodega.nombre, None],
+            [None, '2024-03-12T08:00:00', 'Entrada', material, 1, self.bodega.nombre, None],
+            [None, 'no es fecha', 'Entrada', material, 1, self.bodega.nombre, None],
+        )
+        summary = import_all_data_from_excel(archivo, user=self.usuario)
+        self.assertEqual(summary['errors'], [])
+        self.assertEqual(Movimiento.objects.count(), 3)
+        self.assertEqual(Movimiento.objects.get(id=900).cantidad, 8)
+        self.assertEqual(self.saldo(), 10)
+
+
+class TareaReporteTests(InventarioTestCase):
+
+    def tarea(self, estado, hace):
+        tarea = TareaReporte.objects.create(tipo='importacion', estado=estado, usuario=self.usuario)
+        TareaReporte.objects.filter(pk=tarea.pk).update(actualizado=timezone.now() - hace)
+        return tarea
+
+    def test_stale_jobs_are_marked_as_failed_when_read(self):
+        muerta = self.tarea('en_proceso', timedelta(hours=2))
+        en_cola = self.tarea('pendiente', timedelta(hours=2))
+        viva = self.tarea('en_proceso', timedelta(hours=2))
+        reciente = self.tarea('en_proceso', timedelta(minutes=1))
+        caches['tareas'].set(progress_cache_key(viva.pk), {'Movimientos': 500})
+
+        response = self.client.get(f'/api/tareas/{viva.pk}/')
+        self.assertEqual(response.data['progreso'], {'Movimientos': 500})
+        estados = dict(TareaReporte.objects.values_list('pk', 'estado'))
+        self.assertEqual(estados[muerta.pk], 'error')
+        self.assertEqual(estados[en_cola.pk], 'error')
+        self.assertEqual(estados[viva.pk], 'en_proceso')
+        self.assertEqual(estados[reciente.pk], 'en_proceso')
+
+
+class SeriesTests(InventarioTestCase):
+
+    def totales(self, **filtros):
+        return {(fila['tipo'], fila['total_cantidad'], fila['total_movimientos']) for fila in movement_series(**filtros)}
+
+    def test_traslados_match_either_end_once(self):
+        self.entrada(10, subbodega=self.estante)
+        traslado = Movimiento.objects.create(
+            tipo='Traslado', material=self.material, cantidad=4, bodega=self.bodega, subbodega=self.estante,
+            bodega_destino=self.bodega2
+        )
+        # Within one bodega: origin and destination both match, counted once
+        Movimiento.objects.create(
+            tipo='Traslado', material=self.material, cantidad=1, bodega=self.bodega, subbodega=self.estante,
+            bodega_destino=self.bodega
+        )
+        self.assertEqual(self.totales(), {('Entrada', 10, 1), ('Traslado', 5, 2)})
+        self.assertEqual(self.totales(bodega=self.bodega.id), {('Entrada', 10, 1), ('Traslado', 5, 2)})
+        self.assertEqual(self.totales(bodega=self.bodega2.id), {('Traslado', 4, 1)})
+
+        traslado.bodega_destino, traslado.subbodega_destino = self.bodega2, self.estante2
+        traslado.save()
+        self.assertEqual(self.totales(subbodega=self.estante2.id), {('Traslado', 4, 1)})
+        traslado.delete()
+        self.assertEqual(self.totales(bodega=self.bodega2.id), set())
+
+        response = self.client.get('/api/reportes/series/', {'bodega': self.bodega.id, 'tipo': 'Traslado'})
+        self.assertEqual([fila['total_cantidad'] for fila in response.data], [1])
+
+
+class MovimientoEdicionTests(InventarioTestCase):
+
+    def traslado(self, cantidad):
+        return Movimiento.objects.create(
+            tipo='Traslado', material=self.material, cantidad=cantidad, bodega=self.bodega,
+            bodega_destino=self.bodega2, subbodega_destino=self.estante2
+        )
+
+    def test_partial_update_of_a_traslado_keeps_its_destination(self):
+        self.entrada(10)
+        traslado = self.traslado(4)
+        response = self.client.patch(f'/api/movimientos/{traslado.id}/', {'cantidad': 7}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.saldo(), 3)
+        self.assertEqual(self.saldo(bodega=self.bodega2, subbodega=self.estante2), 7)
+
+        response = self.client.patch(f'/api/movimientos/{traslado.id}/', {'cantidad': 11}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Disponible: 10', str(response.data))
+
+        response = self.client.patch(f'/api/movimientos/{traslado.id}/', {'subbodega_destino': None}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.saldo(bodega=self.bodega2), 7)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plans asserted for SQLite")
+class PlanesStockTests(InventarioTestCase):
+    """The stock aggregates read the ledger through its covering indexes, without touching the table."""
+
+    def plans(self, funcion, *args):
+        with CaptureQueriesContext(connection) as consultas:
+            funcion(*args)
+        planes = []
+        with connection.cursor() as cursor:
+            for consulta in consultas.captured_queries:
+                if consulta['sql'].startswith('SELECT') and 'inventario_asientostock' in consulta['sql']:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {consulta['sql']}")
+                    planes.append(' '.join(str(fila[-1]) for fila in cursor.fetchall()))
+        self.assertTrue(planes)
+        return planes
+
+    def test_ledger_aggregates_are_index_only(self):
+        self.entrada(10, fecha=timezone.now() - timedelta(days=3))
+        # Full rebuild: every location, grouped in index order
+        for plan in self.plans(rebuild_stock_balances, False):
+            self.assertIn("USING COVERING INDEX asiento_ubicacion_idx", plan)
+
+        # Stock at an instant: the entries between the closest closing and it
+        create_closing(timezone.now() - timedelta(days=2))
+        self.entrada(5, fecha=timezone.now() - timedelta(days=1))
+        planes = self.plans(stock_as_of, timezone.now() - timedelta(hours=30))
+        self.assertTrue(any("USING COVERING INDEX asiento_fecha_idx" in plan for plan in planes), planes)
+        self.assertFalse(any("SCAN inventario_asientostock" in plan and "COVERING" not in plan for plan in planes), planes)
+
+
+class MovimientosMasivosTests(InventarioTestCase):
+    """Bulk inserts skip the model signals; they must leave the same derived state."""
+
+    def assert_closings_follow_history(self, cierre):
+        cierre.refresh_from_db()
+        self.assertFalse(cierre.vigente)
+        refresh_closings()
+        saldos = {
+            (s.material_id, s.bodega_id, s.subbodega_id): s.cantidad
+            for s in SaldoInventario.objects.exclude(cantidad=0)
+        }
+        self.assertEqual({k: q for k, q in stock_as_of(timezone.now()).items() if q}, saldos)
+
+    def test_bulk_endpoint_invalidates_later_closings(self):
+        cierre = create_closing(timezone.now() - timedelta(days=1))
+        linea = {
+            'tipo': 'Entrada', 'material': self.material.id, 'cantidad': 5, 'bodega': self.bodega.id,
+            'fecha': (timezone.now() - timedelta(days=2)).isoformat(),
+        }
+        response = self.client.post('/api/movimientos/bulk/', [linea], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assert_closings_follow_history(cierre)
+        self.assertEqual(SaldoCierre.objects.get(cierre=cierre, material=self.material).cantidad, 5)
+
+    def test_populate_polvorin_invalidates_later_closings(self):
+        cierre = create_closing(timezone.now() - timedelta(hours=1))
+        call_command('populate_polvorin', stdout=StringIO())
+        self.assert_closings_follow_history(cierre)
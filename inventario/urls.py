@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     BodegaViewSet, SubbodegaViewSet, MaterialViewSet, 
     FacturaViewSet, MovimientoViewSet,
-    MarcaViewSet, ReportesViewSet, UnidadMedidaViewSet
+    MarcaViewSet, ReportesViewSet, UnidadMedidaViewSet, TareaReporteViewSet, UmbralStockViewSet
 )
 
 router = DefaultRouter()
@@ -15,6 +15,8 @@ router.register(r'movimientos', MovimientoViewSet)
 router.register(r'marcas', MarcaViewSet)
 router.register(r'unidades', UnidadMedidaViewSet)
 router.register(r'reportes', ReportesViewSet, basename='reportes')
+router.register(r'tareas', TareaReporteViewSet)
+router.register(r'umbrales', UmbralStockViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,15 +1,83 @@
 import openpyxl
-from io import BytesIO
+import datetime
+import tempfile
+from django.db import transaction
+from django.utils import timezone
 from .models import Bodega, Subbodega, Material, Marca, Factura, Movimiento, UnidadMedida
+from .stock import rebuild_stock_balances, record_entries
+from .series import rebuild_rollups
+from .busqueda import invalidate_all_barcodes
+from .versiones import bump_catalog_versions
+from .reportes import invalidate_reports
+from .cierres import invalidate_closings
+from usuarios.models import Usuario
+
+# Rows fetched per round trip when streaming querysets into the workbook
+EXPORT_CHUNK_SIZE = 2000
+# Rows between two progress reports to background jobs
+PROGRESS_EVERY = 1000
+
+def _excel_value(val):
+    # Excel cannot store timezone-aware datetimes
+    if isinstance(val, datetime.datetime) and timezone.is_aware(val):
+        return timezone.localtime(val).replace(tzinfo=None)
+    return val
+
+def _track(rows, sheet_name, progress):
+    """Yields rows unchanged, reporting progress(sheet_name, rows_done) periodically."""
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if progress and count % PROGRESS_EVERY == 0:
+            progress(sheet_name, count)
+    if progress:
+        progress(sheet_name, count)
+
+def export_all_data_to_excel(template=False, progress=None):
+    """
+    Builds the backup workbook in openpyxl write-only mode into a temporary file
+    on disk and returns it positioned at the start, ready to be streamed. Rows are
+    read with server-side chunking and related names come from lookup dicts built
+    once, so memory stays flat regardless of the number of movements.
+    """
+    output = tempfile.TemporaryFile()
+    wb = openpyxl.Workbook(write_only=True)
+
+    # Display names used for foreign keys, built once per export
+    lookups = {}
+    if not template:
+        lookups = {
+            'bodega': dict(Bodega.objects.values_list('id', 'nombre')),
+            'subbodega': dict(Subbodega.objects.values_list('id', 'display_path')),
+            'material': {
+                pk: f"{codigo} - {nombre}"
+                for pk, codigo, nombre in Material.objects.values_list('id', 'codigo', 'nombre').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+            },
+            'marca': dict(Marca.objects.values_list('id', 'nombre')),
+            'usuario': {
+                pk: f"{username} ({dict(Usuario.ROLES).get(rol, rol)})"
+                for pk, username, rol in Usuario.objects.values_list('id', 'username', 'rol')
+            },
+        }
+        lookups['bodega_destino'] = lookups['bodega']
+        lookups['subbodega_destino'] = lookups['subbodega']
+        lookups['parent'] = lookups['subbodega']
+
+    def column(field):
+        # Foreign keys are read as raw ids and resolved through the lookups
+        return f"{field}_id" if field in lookups else field
+
+    def write_rows(ws, queryset, fields):
+        rows = queryset.values_list(*[column(f) for f in fields]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        for values in _track(rows, ws.title, progress):
+            row = []
+            for field, val in zip(fields, values):
+                if field in lookups:
+                    val = lookups[field].get(val) if val is not None else None
+                row.append(_excel_value(val))
+            ws.append(row)
 
-def export_all_data_to_excel(template=False):
-    output = BytesIO()
-    wb = openpyxl.Workbook()
-    
-    # Remove default sheet
-    default_sheet = wb.active
-    wb.remove(default_sheet)
-    
     # helper for adding sheets
     def add_sheet(name, queryset, fields, header_names=None):
         ws = wb.create_sheet(title=name)
@@ -17,28 +85,19 @@ def export_all_data_to_excel(template=False):
         ws.append(headers)
         
         if not template:
-            for obj in queryset:
-                row = []
-                for field in fields:
-                    val = getattr(obj, field)
-                    # Handle foreign keys or special types
-                    if hasattr(val, '__str__') and not isinstance(val, (str, int, float, bool, type(None))):
-                        row.append(str(val))
-                    else:
-                        row.append(val)
-                ws.append(row)
+            write_rows(ws, queryset, fields)
 
     # 1. Bodegas
     add_sheet(
         "Bodegas", 
-        Bodega.objects.all(), 
+        Bodega.objects.order_by('id'), 
         ['id', 'nombre', 'ubicacion', 'activo']
     )
 
-    # 2. Subbodegas
+    # 2. Subbodegas (parents before children so the backup can be re-imported in order)
     add_sheet(
         "Subbodegas",
-        Subbodega.objects.select_related('bodega', 'parent').all(),
+        Subbodega.objects.order_by('path'),
         ['id', 'nombre', 'bodega', 'parent', 'activo'],
         ['ID', 'Nombre', 'Bodega Padre', 'Subbodega Padre', 'Activo']
     )
@@ -46,7 +105,7 @@ def export_all_data_to_excel(template=False):
     # 3. Materiales
     add_sheet(
         "Materiales",
-        Material.objects.select_related('marca').all(),
+        Material.objects.order_by('id'),
         ['id', 'codigo', 'codigo_barras', 'referencia', 'nombre', 'unidad', 'marca'],
         ['ID', 'Código', 'Código Barras', 'Referencia', 'Nombre', 'Unidad', 'Marca']
     )
@@ -54,24 +113,21 @@ def export_all_data_to_excel(template=False):
     # 4. Marcas
     add_sheet(
         "Marcas",
-        Marca.objects.all(),
+        Marca.objects.order_by('id'),
         ['id', 'nombre', 'activo']
     )
 
     # 5. Facturas
     add_sheet(
         "Facturas",
-        Factura.objects.all(),
+        Factura.objects.order_by('id'),
         ['id', 'numero', 'proveedor', 'fecha']
     )
 
     # 6. Movimientos (Kardex - All)
     add_sheet(
         "Movimientos",
-        Movimiento.objects.select_related(
-            'material', 'bodega', 'subbodega', 'bodega_destino', 
-            'subbodega_destino', 'marca', 'factura', 'usuario'
-        ).all().order_by('-fecha'),
+        Movimiento.objects.order_by('-fecha'),
         ['id', 'fecha', 'tipo', 'material', 'cantidad', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino', 'marca', 'factura_manual', 'observaciones', 'usuario'],
         ['ID', 'Fecha', 'Tipo', 'Material', 'Cantidad', 'Bodega', 'Subbodega', 'Bodega Destino', 'Subbodega Destino', 'Marca', 'Factura Manual', 'Observaciones', 'Usuario']
     )
@@ -103,23 +159,8 @@ def export_all_data_to_excel(template=False):
                 else: example_row.append("")
             ws.append(example_row)
         else:
-            # Query existing movements of this type
-            queryset = Movimiento.objects.filter(tipo=tipo).select_related(
-                'material', 'bodega', 'subbodega', 'bodega_destino', 
-                'subbodega_destino', 'marca'
-            ).order_by('-fecha')
-            for obj in queryset:
-                row = []
-                for field in fields:
-                    if field == 'bodega' and tipo == 'Traslado': val = obj.bodega
-                    elif field == 'subbodega' and tipo == 'Traslado': val = obj.subbodega
-                    else: val = getattr(obj, field)
-                    
-                    if hasattr(val, '__str__') and not isinstance(val, (str, int, float, bool, type(None))):
-                        row.append(str(val))
-                    else:
-                        row.append(val)
-                ws.append(row)
+            # Stream existing movements of this type
+            write_rows(ws, Movimiento.objects.filter(tipo=tipo).order_by('-fecha'), fields)
 
     add_specialized_sheet("Entradas", "Entrada")
     add_specialized_sheet("Salidas", "Salida")
@@ -128,36 +169,125 @@ def export_all_data_to_excel(template=False):
     wb.save(output)
     output.seek(0)
     return output
-from django.db import transaction
-from django.utils import timezone
-import datetime
 
-def import_all_data_from_excel(file_ptr, user=None):
-    wb = openpyxl.load_workbook(file_ptr)
-    summary = {"created": 0, "updated": 0, "errors": []}
+# Rows per INSERT statement during import. Updates use smaller batches because
+# bulk_update builds one CASE WHEN per field whose cost grows with the batch.
+IMPORT_BATCH_SIZE = 1000
+IMPORT_UPDATE_BATCH_SIZE = 200
+
+class SheetColumns:
+    """
+    Resolves the header positions of a sheet once. Matching is flexible:
+    case-insensitive and stripped, falling back to a unique prefix match
+    (handles truncated headers such as "Subbodeg").
+    """
+    def __init__(self, headers):
+        self.headers = [str(h).lower().strip() for h in headers]
+        self._cache = {}
 
-    def get_clean_val(row, headers, col_name):
-        # Flexible matching: case-insensitive and stripped
-        col_name_norm = col_name.lower().strip()
-        headers_norm = [str(h).lower().strip() for h in headers]
-        try:
-            # Try exact match first
-            if col_name_norm in headers_norm:
-                idx = headers_norm.index(col_name_norm)
+    def index(self, col_name):
+        if col_name not in self._cache:
+            col_name_norm = col_name.lower().strip()
+            if col_name_norm in self.headers:
+                idx = self.headers.index(col_name_norm)
             else:
-                # Try partial match if exactly one header starts with the name (handles "Subbodeg")
-                matches = [i for i, h in enumerate(headers_norm) if h.startswith(col_name_norm)]
-                if len(matches) == 1:
-                    idx = matches[0]
-                else:
-                    return None
-            
-            val = row[idx]
-            if val == 'None' or val == '':
-                return None
-            return val
-        except (ValueError, IndexError):
+                matches = [i for i, h in enumerate(self.headers) if h.startswith(col_name_norm)]
+                idx = matches[0] if len(matches) == 1 else None
+            self._cache[col_name] = idx
+        return self._cache[col_name]
+
+    def get(self, row, col_name):
+        idx = self.index(col_name)
+        if idx is None or idx >= len(row):
+            return None
+        val = row[idx]
+        if val == 'None' or val == '':
             return None
+        return val
+
+
+def _sheet(wb, name, progress=None):
+    """Returns (columns, rows) for a sheet, or (None, []) if missing or empty."""
+    if name not in wb.sheetnames:
+        return None, []
+    rows = wb[name].iter_rows(values_only=True)
+    headers = next(rows, None)
+    if not headers:
+        return None, []
+    return SheetColumns(headers), _track(rows, name, progress)
+
+
+def _parse_id(id_val):
+    try:
+        return int(id_val)
+    except (TypeError, ValueError):
+        return None
+
+
+def _aware(value):
+    if isinstance(value, datetime.datetime) and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+class BulkUpserter:
+    """
+    Collects rows for one model and writes them with bulk_create/bulk_update.
+    Rows carrying an ID are split into new versus existing with a single query;
+    rows without ID fall back to a natural key (e.g. nombre, codigo).
+    """
+    def __init__(self, model, fields, natural_key, summary):
+        self.model = model
+        self.fields = fields
+        self.natural_key = natural_key
+        self.summary = summary
+        self.by_id = {}
+        self.by_key = {}
+
+    def add(self, id_val, defaults):
+        pk = _parse_id(id_val)
+        bucket, key = (self.by_id, pk) if pk else (self.by_key, defaults[self.natural_key])
+        if key in bucket:
+            # Repeated row: the last one wins, as with update_or_create
+            self.summary["updated"] += 1
+        bucket[key] = defaults
+
+    def flush(self):
+        existing_ids = set(
+            self.model.objects.filter(id__in=list(self.by_id)).values_list('id', flat=True)
+        ) if self.by_id else set()
+        existing_keys = dict(
+            self.model.objects.filter(**{f"{self.natural_key}__in": list(self.by_key)})
+            .values_list(self.natural_key, 'id')
+        ) if self.by_key else {}
+
+        to_create, to_update = [], []
+        for pk, defaults in self.by_id.items():
+            (to_update if pk in existing_ids else to_create).append(self.model(id=pk, **defaults))
+        for key, defaults in self.by_key.items():
+            if key in existing_keys:
+                to_update.append(self.model(id=existing_keys[key], **defaults))
+            else:
+                to_create.append(self.model(**defaults))
+
+        self.model.objects.bulk_create(to_create, batch_size=IMPORT_BATCH_SIZE)
+        if to_update:
+            self.model.objects.bulk_update(to_update, self.fields, batch_size=IMPORT_UPDATE_BATCH_SIZE)
+        self.summary["created"] += len(to_create)
+        self.summary["updated"] += len(to_update)
+        return len(to_create) + len(to_update)
+
+
+def import_all_data_from_excel(file_ptr, user=None, progress=None):
+    wb = openpyxl.load_workbook(file_ptr, read_only=True, data_only=True)
+    try:
+        return _import_workbook(wb, user, progress)
+    finally:
+        wb.close()
+
+
+def _import_workbook(wb, user, progress):
+    summary = {"created": 0, "updated": 0, "errors": []}
 
     # We import in a specific order to handle dependencies
     # 1. Marcas
@@ -166,233 +296,297 @@ def import_all_data_from_excel(file_ptr, user=None):
     # 4. Materiales
     # 5. Facturas
     # 6. Movimientos
+    # Reference tables are resolved through name -> id maps built once per sheet.
 
     with transaction.atomic():
         # --- Marcas ---
-        if "Marcas" in wb.sheetnames:
-            ws = wb["Marcas"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "id")
-                    nombre = get_clean_val(row, headers, "nombre")
-                    activo = get_clean_val(row, headers, "activo")
-                    
-                    if nombre:
-                        defaults = {'nombre': nombre, 'activo': bool(activo) if activo is not None else True}
-                        if id_val:
-                            obj, created = Marca.objects.update_or_create(id=id_val, defaults=defaults)
-                        else:
-                            # Natural key fallback: nombre
-                            obj, created = Marca.objects.update_or_create(nombre=nombre, defaults=defaults)
-                        
-                        if created: summary["created"] += 1
-                        else: summary["updated"] += 1
+        cols, rows = _sheet(wb, "Marcas", progress)
+        upserter = BulkUpserter(Marca, ['nombre', 'activo'], 'nombre', summary)
+        for row in rows:
+            nombre = cols.get(row, "nombre")
+            if nombre:
+                activo = cols.get(row, "activo")
+                upserter.add(cols.get(row, "id"), {'nombre': nombre, 'activo': bool(activo) if activo is not None else True})
+        upserter.flush()
 
         # --- Bodegas ---
-        if "Bodegas" in wb.sheetnames:
-            ws = wb["Bodegas"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "id")
-                    nombre = get_clean_val(row, headers, "nombre")
-                    ubicacion = get_clean_val(row, headers, "ubicacion") or ""
-                    activo = get_clean_val(row, headers, "activo")
-                    
-                    if nombre:
-                        defaults = {'nombre': nombre, 'ubicacion': ubicacion, 'activo': bool(activo) if activo is not None else True}
-                        if id_val:
-                            obj, created = Bodega.objects.update_or_create(id=id_val, defaults=defaults)
-                        else:
-                            # Natural key fallback: nombre
-                            obj, created = Bodega.objects.update_or_create(nombre=nombre, defaults=defaults)
-                        
-                        if created: summary["created"] += 1
-                        else: summary["updated"] += 1
+        cols, rows = _sheet(wb, "Bodegas", progress)
+        upserter = BulkUpserter(Bodega, ['nombre', 'ubicacion', 'activo'], 'nombre', summary)
+        for row in rows:
+            nombre = cols.get(row, "nombre")
+            if nombre:
+                activo = cols.get(row, "activo")
+                upserter.add(cols.get(row, "id"), {
+                    'nombre': nombre,
+                    'ubicacion': cols.get(row, "ubicacion") or "",
+                    'activo': bool(activo) if activo is not None else True
+                })
+        bodegas_escritas = upserter.flush()
+
+        bodegas = dict(Bodega.objects.values_list('nombre', 'id'))
 
         # --- Subbodegas ---
-        if "Subbodegas" in wb.sheetnames:
-            ws = wb["Subbodegas"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "ID")
-                    nombre = get_clean_val(row, headers, "Nombre")
-                    bodega_val = get_clean_val(row, headers, "Bodega Padre")
-                    parent_val = get_clean_val(row, headers, "Subbodega Padre")
-                    
-                    if nombre and bodega_val:
-                        bodega_obj = Bodega.objects.filter(nombre=bodega_val).first()
-                        if bodega_obj:
-                            parent_obj = None
-                            if parent_val:
-                                parent_obj = Subbodega.objects.filter(nombre=parent_val, bodega=bodega_obj).first()
-                            
-                            defaults = {
-                                'nombre': nombre, 
-                                'bodega': bodega_obj, 
-                                'parent': parent_obj,
-                                'activo': True
-                            }
-                            if id_val:
-                                obj, created = Subbodega.objects.update_or_create(id=id_val, defaults=defaults)
-                            else:
-                                # Natural key fallback: nombre + bodega
-                                obj, created = Subbodega.objects.update_or_create(nombre=nombre, bodega=bodega_obj, defaults=defaults)
-                            
-                            if created: summary["created"] += 1
-                            else: summary["updated"] += 1
+        subbodegas_escritas = _import_subbodegas(wb, bodegas, summary, progress)
+        if bodegas_escritas or subbodegas_escritas:
+            # Bulk writes bypass Subbodega.save(), so rebuild the stored paths
+            Subbodega.rebuild_tree()
+
+        marcas = dict(Marca.objects.values_list('nombre', 'id'))
 
         # --- Materiales ---
-        if "Materiales" in wb.sheetnames:
-            ws = wb["Materiales"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "ID")
-                    codigo = get_clean_val(row, headers, "Código")
-                    nombre = get_clean_val(row, headers, "Nombre")
-                    if codigo and nombre:
-                        marca_val = get_clean_val(row, headers, "Marca")
-                        marca_obj = None
-                        if marca_val:
-                            # For Brand lookup in Material sheets, we assume it's by name
-                            marca_obj = Marca.objects.filter(nombre=marca_val).first()
-                        
-                        defaults = {
-                            'codigo': codigo,
-                            'codigo_barras': get_clean_val(row, headers, "Código Barras"),
-                            'referencia': get_clean_val(row, headers, "Referencia"),
-                            'nombre': nombre,
-                            'unidad': get_clean_val(row, headers, "Unidad") or "und",
-                            'marca': marca_obj
-                        }
-                        if id_val:
-                            obj, created = Material.objects.update_or_create(id=id_val, defaults=defaults)
-                        else:
-                            # Natural key fallback: codigo
-                            obj, created = Material.objects.update_or_create(codigo=codigo, defaults=defaults)
-                        
-                        if created: summary["created"] += 1
-                        else: summary["updated"] += 1
+        cols, rows = _sheet(wb, "Materiales", progress)
+        upserter = BulkUpserter(
+            Material, ['codigo', 'codigo_barras', 'referencia', 'nombre', 'unidad', 'marca'], 'codigo', summary
+        )
+        for row in rows:
+            codigo = cols.get(row, "Código")
+            nombre = cols.get(row, "Nombre")
+            if codigo and nombre:
+                # For Brand lookup in Material sheets, we assume it's by name
+                marca_val = cols.get(row, "Marca")
+                upserter.add(cols.get(row, "ID"), {
+                    'codigo': codigo,
+                    'codigo_barras': cols.get(row, "Código Barras"),
+                    'referencia': cols.get(row, "Referencia"),
+                    'nombre': nombre,
+                    'unidad': cols.get(row, "Unidad") or "und",
+                    'marca_id': marcas.get(marca_val) if marca_val else None
+                })
+        upserter.flush()
 
         # --- Facturas ---
-        if "Facturas" in wb.sheetnames:
-            ws = wb["Facturas"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "id")
-                    numero = get_clean_val(row, headers, "numero")
-                    if numero:
-                        fecha_val = get_clean_val(row, headers, "fecha")
-                        if isinstance(fecha_val, str):
-                            try: fecha_val = datetime.datetime.strptime(fecha_val, '%Y-%m-%d').date()
-                            except: fecha_val = timezone.now().date()
-                        
-                        defaults = {
-                            'numero': numero,
-                            'proveedor': get_clean_val(row, headers, "proveedor") or "",
-                            'fecha': fecha_val if fecha_val else timezone.now().date()
-                        }
-                        if id_val:
-                            obj, created = Factura.objects.update_or_create(id=id_val, defaults=defaults)
-                        else:
-                            # Natural key fallback: numero
-                            obj, created = Factura.objects.update_or_create(numero=numero, defaults=defaults)
-                        
-                        if created: summary["created"] += 1
-                        else: summary["updated"] += 1
+        cols, rows = _sheet(wb, "Facturas", progress)
+        upserter = BulkUpserter(Factura, ['numero', 'proveedor', 'fecha'], 'numero', summary)
+        for row in rows:
+            numero = cols.get(row, "numero")
+            if numero:
+                fecha_val = cols.get(row, "fecha")
+                if isinstance(fecha_val, str):
+                    try: fecha_val = datetime.datetime.strptime(fecha_val, '%Y-%m-%d').date()
+                    except (ValueError, TypeError): fecha_val = timezone.now().date()
+                elif isinstance(fecha_val, datetime.datetime):
+                    fecha_val = fecha_val.date()
+                upserter.add(cols.get(row, "id"), {
+                    'numero': numero,
+                    'proveedor': cols.get(row, "proveedor") or "",
+                    'fecha': fecha_val if fecha_val else timezone.now().date()
+                })
+        upserter.flush()
 
         # --- Movimientos ---
-        if "Movimientos" in wb.sheetnames:
-            ws = wb["Movimientos"]
-            rows = list(ws.rows)
-            if len(rows) > 1:
-                headers = [str(cell.value) for cell in rows[0]]
-                for row_cells in rows[1:]:
-                    row = [cell.value for cell in row_cells]
-                    id_val = get_clean_val(row, headers, "ID")
-                    tipo = get_clean_val(row, headers, "Tipo")
-                    material_val = get_clean_val(row, headers, "Material")
-                    cantidad = get_clean_val(row, headers, "Cantidad")
-                    bodega_val = get_clean_val(row, headers, "Bodega")
-                    
-                    if tipo and material_val and cantidad is not None and bodega_val:
-                        # Resolve material (Material column has "codigo - nombre")
-                        mat_code = str(material_val).split(' - ')[0]
-                        mat_obj = Material.objects.filter(codigo=mat_code).first()
-                        
-                        bod_obj = Bodega.objects.filter(nombre=bodega_val).first()
-                        
-                        if mat_obj and bod_obj:
-                            # Resolve optional subbodega
-                            sub_val = get_clean_val(row, headers, "Subbodega")
-                            sub_obj = None
-                            if sub_val:
-                                sub_obj = Subbodega.objects.filter(nombre=sub_val, bodega=bod_obj).first()
-                            
-                            # Resolve destination for traslados
-                            bod_dest_val = get_clean_val(row, headers, "Bodega Destino")
-                            bod_dest_obj = None
-                            if bod_dest_val:
-                                bod_dest_obj = Bodega.objects.filter(nombre=bod_dest_val).first()
-                            
-                            sub_dest_val = get_clean_val(row, headers, "Subbodega Destino")
-                            sub_dest_obj = None
-                            if sub_dest_val and bod_dest_obj:
-                                sub_dest_obj = Subbodega.objects.filter(nombre=sub_dest_val, bodega=bod_dest_obj).first()
-
-                            # Resolve Marca
-                            marca_val = get_clean_val(row, headers, "Marca")
-                            marca_obj = None
-                            if marca_val:
-                                marca_obj = Marca.objects.filter(nombre=marca_val).first()
-
-                            # Date parsing
-                            fecha_val = get_clean_val(row, headers, "Fecha")
-                            if isinstance(fecha_val, str):
-                                try: fecha_val = timezone.datetime.fromisoformat(fecha_val)
-                                except: fecha_val = timezone.now()
-                            elif not fecha_val:
-                                fecha_val = timezone.now()
-
-                            defaults = {
-                                'tipo': tipo,
-                                'material': mat_obj,
-                                'cantidad': int(float(cantidad)),
-                                'bodega': bod_obj,
-                                'subbodega': sub_obj,
-                                'bodega_destino': bod_dest_obj,
-                                'subbodega_destino': sub_dest_obj,
-                                'marca': marca_obj,
-                                'fecha': fecha_val,
-                                'factura_manual': get_clean_val(row, headers, "Factura Manual"),
-                                'observaciones': get_clean_val(row, headers, "Observaciones"),
-                                'usuario': user
-                            }
-                            
-                            if id_val:
-                                obj, created = Movimiento.objects.update_or_create(id=id_val, defaults=defaults)
-                            else:
-                                # New movement row (creation)
-                                obj = Movimiento.objects.create(**defaults)
-                                created = True
-                            
-                            if created: summary["created"] += 1
-                            else: summary["updated"] += 1
-                        else:
-                            summary["errors"].append(f"No se encontró Material '{material_val}' o Bodega '{bodega_val}' para una fila.")
+        desde = _import_movimientos(wb, bodegas, marcas, user, summary, progress)
+        if desde is not None:
+            # Bulk writes bypass the Movimiento signals, so rebuild the balances once
+            # (from the latest closing the import left vigente)
+            invalidate_closings(desde)
+            rebuild_stock_balances()
+            rebuild_rollups()
+
+        # Bulk writes bypass the catalog signals too
+        transaction.on_commit(invalidate_all_barcodes)
+        transaction.on_commit(invalidate_reports)
+        bump_catalog_versions('marca', 'bodega', 'subbodega', 'material')
 
     return summary
+
+
+def _remember_subbodega(lookup, full_paths, pk, bodega_id, nombre, full_path, display_path):
+    # By nombre the first match wins (as .first() did); full paths are unique per bodega
+    lookup.setdefault((bodega_id, nombre), pk)
+    lookup[(bodega_id, full_path)] = pk
+    lookup[(bodega_id, display_path)] = pk
+    full_paths[pk] = full_path
+
+
+def _subbodega_lookup():
+    """
+    Maps (bodega_id, name) to a subbodega id, where name may be the nombre, the
+    full path or the bodega-qualified display path (the format of the export).
+    Also returns the full path of every id.
+    """
+    lookup, full_paths = {}, {}
+    for pk, bodega_id, nombre, full_path, display_path in Subbodega.objects.values_list(
+        'id', 'bodega_id', 'nombre', 'full_path', 'display_path'
+    ):
+        _remember_subbodega(lookup, full_paths, pk, bodega_id, nombre, full_path, display_path)
+    return lookup, full_paths
+
+
+def _import_subbodegas(wb, bodegas, summary, progress):
+    cols, rows = _sheet(wb, "Subbodegas", progress)
+    if cols is None:
+        return 0
+
+    lookup, full_paths = _subbodega_lookup()
+    existing_ids = set(full_paths)
+    to_create, to_update = [], []
+    # Lookup keys of rows created in this sheet that have no id yet
+    pending_keys = {}
+
+    def remember(obj):
+        _remember_subbodega(lookup, full_paths, obj.pk, obj.bodega_id, obj.nombre, obj.full_path, obj.display_path)
+
+    def flush_creates():
+        Subbodega.objects.bulk_create(to_create, batch_size=IMPORT_BATCH_SIZE)
+        for obj in to_create:
+            existing_ids.add(obj.pk)
+            remember(obj)
+        summary["created"] += len(to_create)
+        to_create.clear()
+        pending_keys.clear()
+
+    written = 0
+    for row in rows:
+        nombre = cols.get(row, "Nombre")
+        bodega_val = cols.get(row, "Bodega Padre")
+        bodega_id = bodegas.get(bodega_val) if nombre and bodega_val else None
+        if not bodega_id:
+            continue
+
+        parent_id = None
+        parent_val = cols.get(row, "Subbodega Padre")
+        if parent_val:
+            parent_key = (bodega_id, parent_val)
+            if parent_key not in lookup and parent_key in pending_keys:
+                # Parent was created earlier in this sheet: insert it to get its id
+                flush_creates()
+            parent_id = lookup.get(parent_key)
+
+        full_path = f"{full_paths[parent_id]} > {nombre}" if parent_id else nombre
+        # Natural key fallback: position in the tree of the bodega
+        pk = _parse_id(cols.get(row, "ID")) or lookup.get((bodega_id, full_path))
+        if not pk and (bodega_id, full_path) in pending_keys:
+            # Repeated row for a subbodega created earlier in this sheet
+            summary["updated"] += 1
+            continue
+        obj = Subbodega(
+            id=pk, nombre=nombre, bodega_id=bodega_id, parent_id=parent_id, activo=True,
+            full_path=full_path, display_path=f"{bodega_val} - {full_path}"
+        )
+        written += 1
+
+        if pk in existing_ids:
+            to_update.append(obj)
+            summary["updated"] += 1
+            remember(obj)
+        elif pk:
+            to_create.append(obj)
+            existing_ids.add(pk)
+            remember(obj)
+        else:
+            to_create.append(obj)
+            for key in [(bodega_id, nombre), (bodega_id, full_path), (bodega_id, obj.display_path)]:
+                pending_keys[key] = obj
+
+    flush_creates()
+    Subbodega.objects.bulk_update(to_update, ['nombre', 'bodega', 'parent', 'activo'], batch_size=IMPORT_UPDATE_BATCH_SIZE)
+    return written
+
+
+def _import_movimientos(wb, bodegas, marcas, user, summary, progress):
+    """Upserts the Movimientos sheet; returns the earliest fecha it wrote (old or new), or None."""
+    cols, rows = _sheet(wb, "Movimientos", progress)
+    if cols is None:
+        return None
+
+    materiales = dict(Material.objects.values_list('codigo', 'id'))
+    subbodegas, _ = _subbodega_lookup()
+    fields = [
+        'tipo', 'material', 'cantidad', 'bodega', 'subbodega', 'bodega_destino', 'subbodega_destino',
+        'marca', 'fecha', 'factura_manual', 'observaciones', 'usuario'
+    ]
+    # Keyed by ID: a repeated ID keeps its last row, as update_or_create did.
+    # Rows without ID are always new.
+    pending = {}
+    earliest = [None]
+
+    attnames = [Movimiento._meta.get_field(f).attname for f in fields]
+
+    def flush():
+        pending_rows = list(pending.values())
+        ids = [mov.id for mov in pending_rows if mov.id]
+        stored = {
+            values[0]: values[1:]
+            for values in Movimiento.objects.filter(id__in=ids).values_list('id', *attnames)
+        } if ids else {}
+        to_create = [mov for mov in pending_rows if mov.id not in stored]
+        # Only rows and columns that differ from what is stored are rewritten;
+        # restoring a backup onto the same data writes nothing.
+        to_update, changed_fields = [], set()
+        fechas = [mov.fecha for mov in to_create]
+        for mov in pending_rows:
+            if mov.id in stored:
+                diff = {f for f, a, old in zip(fields, attnames, stored[mov.id]) if getattr(mov, a) != old}
+                if diff:
+                    to_update.append(mov)
+                    changed_fields |= diff
+                    fechas += [mov.fecha, stored[mov.id][fields.index('fecha')]]
+        Movimiento.objects.bulk_create(to_create, batch_size=IMPORT_BATCH_SIZE)
+        if to_update:
+            Movimiento.objects.bulk_update(
+                to_update, [f for f in fields if f in changed_fields], batch_size=IMPORT_UPDATE_BATCH_SIZE
+            )
+        # The balances are rebuilt from the ledger afterwards, so it is written here
+        record_entries(to_create)
+        record_entries(to_update, replace=True)
+        summary["created"] += len(to_create)
+        summary["updated"] += len(pending) - len(to_create)
+        if earliest[0] is not None:
+            fechas.append(earliest[0])
+        if fechas:
+            earliest[0] = min(fechas)
+        pending.clear()
+
+    for row in rows:
+        tipo = cols.get(row, "Tipo")
+        material_val = cols.get(row, "Material")
+        cantidad = cols.get(row, "Cantidad")
+        bodega_val = cols.get(row, "Bodega")
+
+        if not (tipo and material_val and cantidad is not None and bodega_val):
+            continue
+
+        # Resolve material (Material column has "codigo - nombre")
+        mat_id = materiales.get(str(material_val).split(' - ')[0])
+        bod_id = bodegas.get(bodega_val)
+        if not (mat_id and bod_id):
+            summary["errors"].append(f"No se encontró Material '{material_val}' o Bodega '{bodega_val}' para una fila.")
+            continue
+
+        sub_val = cols.get(row, "Subbodega")
+        bod_dest_val = cols.get(row, "Bodega Destino")
+        bod_dest_id = bodegas.get(bod_dest_val) if bod_dest_val else None
+        sub_dest_val = cols.get(row, "Subbodega Destino")
+        marca_val = cols.get(row, "Marca")
+
+        # Date parsing
+        fecha_val = cols.get(row, "Fecha")
+        if isinstance(fecha_val, str):
+            try: fecha_val = timezone.datetime.fromisoformat(fecha_val)
+            except (ValueError, TypeError): fecha_val = timezone.now()
+        elif not fecha_val:
+            fecha_val = timezone.now()
+
+        mov_id = _parse_id(cols.get(row, "ID"))
+        if mov_id and mov_id in pending:
+            summary["updated"] += 1
+        pending[mov_id or object()] = Movimiento(
+            id=mov_id,
+            tipo=tipo,
+            material_id=mat_id,
+            cantidad=int(float(cantidad)),
+            bodega_id=bod_id,
+            subbodega_id=subbodegas.get((bod_id, sub_val)) if sub_val else None,
+            bodega_destino_id=bod_dest_id,
+            subbodega_destino_id=subbodegas.get((bod_dest_id, sub_dest_val)) if sub_dest_val and bod_dest_id else None,
+            marca_id=marcas.get(marca_val) if marca_val else None,
+            fecha=_aware(fecha_val),
+            factura_manual=cols.get(row, "Factura Manual"),
+            observaciones=cols.get(row, "Observaciones"),
+            usuario=user
+        )
+        if len(pending) >= IMPORT_BATCH_SIZE:
+            flush()
+
+    flush()
+    return earliest[0]
@@ -0,0 +1,69 @@
+import hashlib
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .models import VersionCatalogo
+
+
+def bump_catalog_versions(*catalogos):
+    """Marks catalogs (model names, e.g. 'material') as changed, inside the writer's transaction."""
+    now = timezone.now()
+    for catalogo in catalogos:
+        updated = VersionCatalogo.objects.filter(catalogo=catalogo).update(version=F('version') + 1, actualizado=now)
+        if not updated:
+            VersionCatalogo.objects.get_or_create(catalogo=catalogo, defaults={'version': 1, 'actualizado': now})
+
+
+def catalog_versions(catalogos):
+    """(version tag, last modified) of a set of catalogs, in one query."""
+    rows = {
+        catalogo: (version, actualizado)
+        for catalogo, version, actualizado in VersionCatalogo.objects.filter(catalogo__in=catalogos).values_list(
+            'catalogo', 'version', 'actualizado'
+        )
+    }
+    tag = '-'.join(f"{catalogo}.{rows.get(catalogo, (0, None))[0]}" for catalogo in catalogos)
+    modified = [actualizado for _, actualizado in rows.values()]
+    return tag, max(modified) if modified else None
+
+
+class ConditionalCatalogMixin:
+    """
+    ViewSet mixin for catalogs: list and retrieve carry ETag / Last-Modified
+    built from the versions of catalog_dependencies, and a request whose
+    If-None-Match (or If-Modified-Since) still matches gets a 304 before any
+    list query or serialization runs.
+    """
+    catalog_dependencies = ()
+
+    def conditional_enabled(self):
+        return True
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(request, super().retrieve, *args, **kwargs)
+
+    def _conditional(self, request, handler, *args, **kwargs):
+        if not self.conditional_enabled():
+            return handler(request, *args, **kwargs)
+
+        tag, last_modified = catalog_versions(self.catalog_dependencies)
+        # The same version renders differently per URL (filters, fields=) and format
+        key = f"{tag}|{request.get_full_path()}|{request.accepted_renderer.format}"
+        etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        result = handler(request, *args, **kwargs)
+        if result.status_code == 200:
+            result['ETag'] = etag
+            if timestamp is not None:
+                result['Last-Modified'] = http_date(timestamp)
+        return result
@@ -1,23 +1,95 @@
 from rest_framework import viewsets, response, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.db.models import Sum, Q
-from .models import Bodega, Subbodega, Material, Factura, Movimiento, Marca, UnidadMedida
+from .models import (
+    Bodega, Subbodega, Material, Factura, Movimiento, Marca, UnidadMedida, TareaReporte,
+    UmbralStock, AlertaStock
+)
 from .serializers import (
     BodegaSerializer, BodegaSimpleSerializer, SubbodegaSerializer, 
-    MaterialSerializer, FacturaSerializer, MovimientoSerializer, 
-    MarcaSerializer, UnidadMedidaSerializer
+    MaterialSerializer, FacturaSerializer, MovimientoSerializer, MovimientoListSerializer,
+    MarcaSerializer, UnidadMedidaSerializer, MovimientoBulkItemSerializer, DisponibilidadItemSerializer,
+    TareaReporteSerializer, UmbralStockSerializer, AlertaStockSerializer
 )
+from .stock import check_availability, check_batch_stock
 from .utils import export_all_data_to_excel, import_all_data_from_excel
+from .tareas import expire_stale_jobs, submit_export, submit_import
+from .pagination import KardexPagination, StockPagination
+from .fieldsets import SparseFieldsViewMixin
+from .busqueda import search_materials, lookup_barcode, invalidate_barcodes
+from .versiones import ConditionalCatalogMixin, bump_catalog_versions
+from .reportes import cached_report
+from .series import AGRUPACIONES, PERIODOS, movement_series
+from .cierres import stock_as_of
+from .signals import register_bulk_movements
+from .existencias import (
+    ESTADOS, ORDENAMIENTOS, add_estado, material_distribution, stock_rows, stock_rows_from, stock_tree
+)
 from django.http import FileResponse
 
-class BodegaViewSet(viewsets.ModelViewSet):
+
+def parse_fecha(param, value, fin_del_dia=False):
+    """Parses a date or datetime filter; with fin_del_dia a bare date becomes the next midnight."""
+    try:
+        dia = parse_date(value)
+        if dia is not None:
+            fecha = datetime.combine(dia + timedelta(days=1) if fin_del_dia else dia, time.min)
+        else:
+            fecha = parse_datetime(value)
+            if fecha is not None and fin_del_dia:
+                fecha += timedelta(microseconds=1)
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        raise ValidationError({param: "Fecha inválida, use AAAA-MM-DD o AAAA-MM-DDTHH:MM."})
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+def parse_stock_filters(params):
+    """q, estado and ordering of the stock summaries (the location filters are per endpoint)."""
+    estado = params.get('estado')
+    if estado:
+        estado = {e.lower(): e for e in ESTADOS}.get(estado.lower())
+        if estado is None:
+            raise ValidationError({'estado': f"Use {', '.join(ESTADOS)}."})
+    ordering = params.get('ordering')
+    if ordering and ordering.lstrip('-') not in ORDENAMIENTOS:
+        raise ValidationError({'ordering': f"Use {', '.join(ORDENAMIENTOS)}, con '-' para orden descendente."})
+    return {'q': params.get('q', '').strip() or None, 'estado': estado or None, 'ordering': ordering or None}
+
+
+def stock_response(request, rows, fila):
+    """The rows as a list, or as one page when the client asks for it (?page= / ?page_size=)."""
+    paginator = StockPagination()
+    if paginator.is_requested(request):
+        page = add_estado(paginator.paginate_queryset(rows, request))
+        return paginator.get_paginated_response([fila(row) for row in page])
+    return response.Response([fila(row) for row in add_estado(rows)])
+
+class BodegaViewSet(ConditionalCatalogMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Bodega.objects.prefetch_related('subbodegas').all().order_by('nombre')
+    catalog_dependencies = ('bodega', 'subbodega')
 
     def get_serializer_class(self):
         if self.action == 'list':
-            return BodegaSimpleSerializer
+            # materiales_count is opt-in on the list: ?incluir_conteo=true
+            incluir_conteo = self.request.query_params.get('incluir_conteo', 'false').lower() == 'true'
+            if not incluir_conteo:
+                return BodegaSimpleSerializer
         return BodegaSerializer
 
+    def conditional_enabled(self):
+        # materiales_count follows stock, which the catalog versions do not track
+        return self.get_serializer_class() is not BodegaSerializer
+
     def get_queryset(self):
         # By default, only show active bodegas in the list view
         queryset = super().get_queryset()
@@ -41,93 +113,48 @@ class BodegaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def stock_actual(self, request, pk=None):
         bodega = self.get_object()
-        
+        filtros = parse_stock_filters(request.query_params)
+
         # Filter by subbodega if provided (support recursive child stock)
         target_sub_id = request.query_params.get('subbodega')
-        allowed_sub_ids = None 
-        
+        target_sub = None
+
         if target_sub_id:
             try:
                 target_sub = Subbodega.objects.get(id=target_sub_id, bodega=bodega)
-                def get_descendants(sub):
-                    ids = [sub.id]
-                    for child in sub.children.all():
-                        ids.extend(get_descendants(child))
-                    return ids
-                allowed_sub_ids = get_descendants(target_sub)
-            except Subbodega.DoesNotExist:
+            except (Subbodega.DoesNotExist, ValueError):
                 return response.Response({"error": "Subbodega no encontrada"}, status=404)
 
-        # 1. SQL Aggregation for Stock
-        from django.db.models import Sum, F, Case, When, Value
-        
-        filters = Q(bodega=bodega) | Q(bodega_destino=bodega)
-        if allowed_sub_ids is not None:
-            filters &= (Q(subbodega_id__in=allowed_sub_ids) | Q(subbodega_destino_id__in=allowed_sub_ids))
-
-        # We aggregate in two parts: as source and as destination
-        # Then we combine in Python. This is MUCH faster than iterating over all movements.
-        sources = Movimiento.objects.filter(bodega=bodega).values('material', 'subbodega').annotate(
-            qty=Sum(
-                Case(
-                    When(tipo__in=['Entrada', 'Edicion', 'Ajuste', 'Devolucion'], then=F('cantidad')),
-                    When(tipo__in=['Salida', 'Traslado'], then=-F('cantidad')),
-                    default=Value(0)
-                )
-            )
-        )
-        
-        destinations = Movimiento.objects.filter(bodega_destino=bodega).values('material', 'subbodega_destino').annotate(
-            qty=Sum(
-                Case(
-                    When(tipo='Traslado', then=F('cantidad')),
-                    default=Value(0)
-                )
-            )
-        )
-
-        if allowed_sub_ids is not None:
-            sources = sources.filter(subbodega_id__in=allowed_sub_ids)
-            destinations = destinations.filter(subbodega_destino_id__in=allowed_sub_ids)
-
-        inventory = {}
-        for s in sources:
-            key = (s['material'], s['subbodega'])
-            inventory[key] = s['qty'] or 0
-        
-        for d in destinations:
-            key = (d['material'], d['subbodega_destino'])
-            inventory[key] = inventory.get(key, 0) + (d['qty'] or 0)
+        # Materialized balances filtered, sorted and paged in SQL, or the stock
+        # at ?as_of= (a date counts as its end of day) from the closest closing
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            stock = stock_as_of(parse_fecha('as_of', as_of, fin_del_dia=True), bodega_id=bodega.id)
+            rows = stock_rows_from(stock, bodega_id=bodega.id, subbodega=target_sub, **filtros)
+        else:
+            rows = stock_rows(bodega_id=bodega.id, subbodega=target_sub, **filtros)
+
+        return stock_response(request, rows, lambda row: {
+            'id_material': row['material_id'],
+            'codigo': row['material__codigo'],
+            'referencia': row['material__referencia'],
+            'nombre': row['material__nombre'],
+            'cantidad': row['cantidad'],
+            'unidad': row['material__unidad'],
+            'id_subbodega': row['subbodega_id'],
+            'subbodega_nombre': row['subbodega__full_path'] or "General",
+            'estado': row['estado'],
+        })
 
-        # 2. Fetch required Objects in bulk to avoid N+1
-        material_ids = {k[0] for k in inventory.keys()}
-        sub_ids = {k[1] for k in inventory.keys() if k[1] is not None}
-        
-        materials = {m.id: m for m in Material.objects.filter(id__in=material_ids)}
-        # Optimized full path fetching
-        subs_qs = Subbodega.objects.filter(id__in=sub_ids).select_related('parent', 'parent__parent', 'parent__parent__parent')
-        subs = {s.id: s for s in subs_qs}
-
-        resumen = []
-        for (mat_id, sub_id), qty in inventory.items():
-            if qty != 0:
-                mat = materials.get(mat_id)
-                sub_obj = subs.get(sub_id)
-                resumen.append({
-                    'id_material': mat_id,
-                    'codigo': mat.codigo if mat else "",
-                    'referencia': mat.referencia if mat else "",
-                    'nombre': mat.nombre if mat else "Desconocido",
-                    'cantidad': qty,
-                    'unidad': mat.unidad if mat else "",
-                    'id_subbodega': sub_id,
-                    'subbodega_nombre': sub_obj.get_full_path() if sub_obj else "General"
-                })
-        
-        return response.Response(resumen)
+    @action(detail=True, methods=['get'])
+    def arbol_stock(self, request, pk=None):
+        """The whole subbodega tree with stock and material counts rolled up at every node."""
+        return response.Response(stock_tree(self.get_object()))
 
-class SubbodegaViewSet(viewsets.ModelViewSet):
+class SubbodegaViewSet(ConditionalCatalogMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     serializer_class = SubbodegaSerializer
+    # display_path carries the bodega name
+    catalog_dependencies = ('subbodega', 'bodega')
 
     def get_queryset(self):
         queryset = Subbodega.objects.select_related('bodega', 'parent').all()
@@ -157,22 +184,63 @@ class SubbodegaViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(subbodega)
         return response.Response(serializer.data)
 
-class MaterialViewSet(viewsets.ModelViewSet):
-    queryset = Material.objects.all()
+class MaterialViewSet(ConditionalCatalogMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Material.objects.select_related('marca').all()
     serializer_class = MaterialSerializer
+    # marca_nombre, and deleting a Marca nulls Material.marca without Material signals
+    catalog_dependencies = ('material', 'marca')
+
+    @action(detail=False, methods=['get'])
+    def buscar(self, request):
+        """Search by codigo, codigo_barras, referencia or nombre: exact, then prefix, then substring matches."""
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return response.Response({"error": "Debe indicar un texto de búsqueda (q)"}, status=400)
+        try:
+            limite = min(max(int(request.query_params.get('limite', 20)), 1), 100)
+        except ValueError:
+            limite = 20
+        serializer = self.get_serializer(search_materials(q, limite), many=True)
+        return response.Response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path=r'codigo_barras/(?P<codigo>[^/]+)')
+    def codigo_barras(self, request, codigo=None):
+        """Scanner lookup by exact barcode, served from the cache after the first hit."""
+        data = lookup_barcode(codigo, lambda material: dict(MaterialSerializer(material).data))
+        if data is None:
+            return response.Response({"error": "Material no encontrado"}, status=404)
+        return response.Response(data)
+
+    @action(detail=True, methods=['get'])
+    def existencias(self, request, pk=None):
+        """Where the material is: its stock in every bodega and subbodega, with the total."""
+        return response.Response(material_distribution(self.get_object()))
+
+class UmbralStockViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = UmbralStock.objects.select_related('material', 'bodega').order_by('material__codigo', 'bodega__nombre')
+    serializer_class = UmbralStockSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        material_id = self.request.query_params.get('material')
+        if material_id:
+            queryset = queryset.filter(material_id=material_id)
+        return queryset
 
-class FacturaViewSet(viewsets.ModelViewSet):
+class FacturaViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Factura.objects.all()
     serializer_class = FacturaSerializer
 
 
-class MarcaViewSet(viewsets.ModelViewSet):
+class MarcaViewSet(ConditionalCatalogMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Marca.objects.all()
     serializer_class = MarcaSerializer
+    catalog_dependencies = ('marca',)
 
-class UnidadMedidaViewSet(viewsets.ModelViewSet):
+class UnidadMedidaViewSet(ConditionalCatalogMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = UnidadMedida.objects.all()
     serializer_class = UnidadMedidaSerializer
+    catalog_dependencies = ('unidadmedida',)
 
 class ReportesViewSet(viewsets.ViewSet):
     """
@@ -181,6 +249,10 @@ class ReportesViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def resumen_general(self, request):
+        # Dashboard counters, cached until the next Movimiento/Marca write
+        return response.Response(cached_report('resumen_general', {}, self._resumen_general))
+
+    def _resumen_general(self):
         total_entradas = Movimiento.objects.filter(tipo='Entrada').count()
         total_salidas = Movimiento.objects.filter(tipo='Salida').count()
         total_marcas = Marca.objects.filter(activo=True).count()
@@ -188,14 +260,68 @@ class ReportesViewSet(viewsets.ViewSet):
         # Calculate total stock value? Maybe later if we have cost.
         # For now just simple counters
         
-        return response.Response({
+        return {
             'total_entradas': total_entradas,
             'total_salidas': total_salidas,
             'total_marcas_activas': total_marcas,
-        })
+        }
+
+    @action(detail=False, methods=['get'])
+    def series(self, request):
+        """
+        Trend series from the daily rollups: ?periodo=dia|semana|mes, desde/hasta
+        (AAAA-MM-DD), tipo (comma separated), material, bodega, subbodega, marca,
+        and agrupar=material|bodega|marca to split each series. bodega and
+        subbodega match either end of a Traslado; agrupar=bodega splits by origin.
+        """
+        params = request.query_params
+        periodo = params.get('periodo', 'dia')
+        if periodo not in PERIODOS:
+            return response.Response({"error": f"periodo debe ser uno de: {', '.join(PERIODOS)}"}, status=400)
+        agrupar = params.get('agrupar') or None
+        if agrupar is not None and agrupar not in AGRUPACIONES:
+            return response.Response({"error": f"agrupar debe ser uno de: {', '.join(AGRUPACIONES)}"}, status=400)
+
+        try:
+            fechas = {campo: parse_date(params[campo]) if params.get(campo) else None for campo in ('desde', 'hasta')}
+            if any(params.get(campo) and fecha is None for campo, fecha in fechas.items()):
+                raise ValueError
+            filtros = {
+                campo: int(params[campo]) if params.get(campo) else None
+                for campo in ('material', 'bodega', 'subbodega', 'marca')
+            }
+        except ValueError:
+            return response.Response({"error": "Parámetros inválidos: fechas AAAA-MM-DD e ids numéricos"}, status=400)
+        tipos = sorted(t for t in params.get('tipo', '').split(',') if t)
+
+        consulta = dict(periodo=periodo, tipos=tipos, agrupar=agrupar, **fechas, **filtros)
+        data = cached_report('series', consulta, lambda: movement_series(**consulta))
+        return response.Response(data)
+
+    @action(detail=False, methods=['get'])
+    def alertas(self, request):
+        """Materials currently below their reorder level, below-minimum first (?nivel=minimo|reorden, ?bodega=id)."""
+        alertas = AlertaStock.objects.select_related('material', 'bodega').order_by('nivel', 'cantidad', 'id')
+        nivel = request.query_params.get('nivel')
+        if nivel:
+            alertas = alertas.filter(nivel=nivel)
+        bodega_id = request.query_params.get('bodega')
+        if bodega_id:
+            alertas = alertas.filter(bodega_id=bodega_id)
+        return response.Response(AlertaStockSerializer(alertas, many=True).data)
+
+    def _en_segundo_plano(self, request):
+        # Large files can exceed the worker timeout: ?en_segundo_plano=true runs them as a job
+        return request.query_params.get('en_segundo_plano', 'false').lower() == 'true'
+
+    def _tarea_response(self, tarea):
+        return response.Response(TareaReporteSerializer(tarea).data, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=False, methods=['get'])
     def exportar_excel(self, request):
+        if self._en_segundo_plano(request):
+            return self._tarea_response(submit_export(user=request.user))
+
         excel_file = export_all_data_to_excel()
         response = FileResponse(
             excel_file, 
@@ -209,6 +335,9 @@ class ReportesViewSet(viewsets.ViewSet):
         excel_file = request.FILES.get('archivo')
         if not excel_file:
             return response.Response({"error": "No se proporcionó ningún archivo"}, status=400)
+
+        if self._en_segundo_plano(request):
+            return self._tarea_response(submit_import(excel_file, user=request.user))
         
         try:
             summary = import_all_data_from_excel(excel_file, user=request.user)
@@ -218,6 +347,9 @@ class ReportesViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def descargar_plantilla(self, request):
+        if self._en_segundo_plano(request):
+            return self._tarea_response(submit_export(user=request.user, template=True))
+
         excel_file = export_all_data_to_excel(template=True)
         response = FileResponse(
             excel_file, 
@@ -237,10 +369,16 @@ class ReportesViewSet(viewsets.ViewSet):
         return self._get_top_marcas(tipo_movimiento='Salida')
 
     def _get_top_marcas(self, tipo_movimiento):
+        data = cached_report(
+            'top_marcas', {'tipo': tipo_movimiento}, lambda: self._compute_top_marcas(tipo_movimiento)
+        )
+        return response.Response(data)
+
+    def _compute_top_marcas(self, tipo_movimiento):
         from django.db.models import Count, Sum
         
         # Aggregate by brand
-        data = (
+        return list(
             Movimiento.objects
             .filter(tipo=tipo_movimiento, marca__isnull=False)
             .values('marca__nombre')
@@ -250,103 +388,221 @@ class ReportesViewSet(viewsets.ViewSet):
             )
             .order_by('-total_cantidad')[:5]
         )
-        
-        return response.Response(data)
 
 
-class MovimientoViewSet(viewsets.ModelViewSet):
+class TareaReporteViewSet(SparseFieldsViewMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Status of background import/export jobs. Clients poll the detail endpoint
+    until estado is 'completada' or 'error'.
+    """
+    queryset = TareaReporte.objects.all().order_by('-creado')
+    serializer_class = TareaReporteSerializer
+
+    def get_queryset(self):
+        # Jobs whose process died would otherwise stay en_proceso forever
+        expire_stale_jobs()
+        return super().get_queryset()
+
+    @action(detail=True, methods=['get'])
+    def descargar(self, request, pk=None):
+        tarea = self.get_object()
+        if tarea.tipo == 'importacion' or tarea.estado != 'completada' or not tarea.archivo:
+            return response.Response({"error": "La tarea no tiene un archivo disponible"}, status=404)
+        return FileResponse(
+            tarea.archivo.open('rb'),
+            as_attachment=True,
+            filename=tarea.archivo.name.split('/')[-1],
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+
+
+class MovimientoViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Movimiento.objects.select_related(
         'material', 'material__marca', 'bodega', 'subbodega', 'marca', 
         'factura', 'bodega_destino', 'subbodega_destino', 'usuario'
-    ).all().order_by('-fecha')
+    ).all().order_by('-fecha', '-id')
     serializer_class = MovimientoSerializer
+    # ?paginacion=cursor switches to keyset pagination on (fecha, id)
+    pagination_class = KardexPagination
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            # Flat id + name columns; nested objects only with ?expand=
+            return MovimientoListSerializer
+        return MovimientoSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+
+        fecha_desde = params.get('fecha_desde')
+        if fecha_desde:
+            queryset = queryset.filter(fecha__gte=parse_fecha('fecha_desde', fecha_desde))
+        fecha_hasta = params.get('fecha_hasta')
+        if fecha_hasta:
+            # A bare date includes the whole day
+            queryset = queryset.filter(fecha__lt=parse_fecha('fecha_hasta', fecha_hasta, fin_del_dia=True))
+
+        tipos = [t for t in params.get('tipo', '').split(',') if t]
+        if tipos:
+            queryset = queryset.filter(tipo__in=tipos)
+
+        for param in ('material', 'marca', 'usuario', 'factura'):
+            value = params.get(param)
+            if value:
+                queryset = queryset.filter(**{f"{param}_id": self._parse_id(param, value)})
+
+        # A location matches as origin or as destination of a Traslado
+        bodega_id = params.get('bodega')
+        if bodega_id:
+            bodega_id = self._parse_id('bodega', bodega_id)
+            queryset = queryset.filter(Q(bodega_id=bodega_id) | Q(bodega_destino_id=bodega_id))
+        subbodega_id = params.get('subbodega')
+        if subbodega_id:
+            subbodega_id = self._parse_id('subbodega', subbodega_id)
+            queryset = queryset.filter(Q(subbodega_id=subbodega_id) | Q(subbodega_destino_id=subbodega_id))
+
+        return queryset
+
+    def _parse_id(self, param, value):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({param: "Debe ser un id numérico."})
 
     @action(detail=False, methods=['get'])
     def resumen_inventario(self, request):
-        # 1. SQL Aggregation (Grouping by Material, Bodega, Subbodega)
-        from django.db.models import Sum, Case, When, F, Value
-        
-        # We need to handle movements as source and as destination separately because of Traslados
-        sources = Movimiento.objects.values('material', 'bodega', 'subbodega').annotate(
-            q=Sum(
-                Case(
-                    When(tipo__in=['Entrada', 'Edicion', 'Ajuste', 'Devolucion'], then=F('cantidad')),
-                    When(tipo__in=['Salida', 'Traslado'], then=-F('cantidad')),
-                    default=Value(0)
-                )
-            )
-        )
-        
-        destinations = Movimiento.objects.filter(tipo='Traslado').values('material', 'bodega_destino', 'subbodega_destino').annotate(
-            q=Sum('cantidad')
-        )
-
-        inventory = {}
-        for s in sources:
-            key = (s['material'], s['bodega'], s['subbodega'])
-            inventory[key] = s['q'] or 0
-        
-        for d in destinations:
-            key = (d['material'], d['bodega_destino'], d['subbodega_destino'])
-            inventory[key] = inventory.get(key, 0) + (d['q'] or 0)
-
-        # 2. Bulk fetch Meta information
-        material_ids = {k[0] for k in inventory.keys()}
-        bodega_ids = {k[1] for k in inventory.keys()}
-        sub_ids = {k[2] for k in inventory.keys() if k[2] is not None}
-
-        materials = {m.id: m for m in Material.objects.filter(id__in=material_ids)}
-        bodegas_map = {b.id: b for b in Bodega.objects.filter(id__in=bodega_ids)}
-        subs = {s.id: s for s in Subbodega.objects.filter(id__in=sub_ids).select_related('parent', 'parent__parent', 'parent__parent__parent')}
-
-        resumen = []
-        for (mat_id, bod_id, sub_id), qty in inventory.items():
-            if qty != 0:
-                mat = materials.get(mat_id)
-                bod = bodegas_map.get(bod_id)
-                sub = subs.get(sub_id)
-                resumen.append({
-                    'id_material': mat_id,
-                    'codigo': mat.codigo if mat else "",
-                    'referencia': mat.referencia if mat else "",
-                    'nombre': mat.nombre if mat else "Desconocido",
-                    'id_bodega': bod_id,
-                    'bodega': bod.nombre if bod else "Desconocida",
-                    'id_subbodega': sub_id,
-                    'subbodega': sub.get_full_path() if sub else "General",
-                    'cantidad': qty,
-                    'unidad': mat.unidad if mat else "",
-                    'estado': self._get_estado(qty)
-                })
-        
-        return response.Response(resumen)
+        filtros = parse_stock_filters(request.query_params)
+        bodega_id = request.query_params.get('bodega')
+        bodega_id = self._parse_id('bodega', bodega_id) if bodega_id else None
+        subbodega = None
+        subbodega_id = request.query_params.get('subbodega')
+        if subbodega_id:
+            subbodega = Subbodega.objects.filter(id=self._parse_id('subbodega', subbodega_id)).first()
+            if subbodega is None:
+                return response.Response({"error": "Subbodega no encontrada"}, status=404)
 
-    def _get_estado(self, cantidad):
-        if cantidad > 100:
-            return 'Alto'
-        elif cantidad > 20:
-            return 'Medio'
+        # Materialized balances filtered, sorted and paged in SQL, or the stock
+        # at ?as_of= from the closest closing snapshot
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            stock = stock_as_of(parse_fecha('as_of', as_of, fin_del_dia=True), bodega_id=bodega_id)
+            rows = stock_rows_from(stock, bodega_id=bodega_id, subbodega=subbodega, **filtros)
         else:
-            return 'Bajo'
+            rows = stock_rows(bodega_id=bodega_id, subbodega=subbodega, **filtros)
+
+        return stock_response(request, rows, lambda row: {
+            'id_material': row['material_id'],
+            'codigo': row['material__codigo'],
+            'referencia': row['material__referencia'],
+            'nombre': row['material__nombre'],
+            'id_bodega': row['bodega_id'],
+            'bodega': row['bodega__nombre'],
+            'id_subbodega': row['subbodega_id'],
+            'subbodega': row['subbodega__full_path'] or "General",
+            'cantidad': row['cantidad'],
+            'unidad': row['material__unidad'],
+            'estado': row['estado'],
+        })
 
     def perform_create(self, serializer):
-        movimiento = serializer.save(usuario=self.request.user)
-        
-        material = movimiento.material
-        should_save_material = False
+        data = serializer.validated_data
+        material = data['material']
+        extra = {'usuario': self.request.user}
+
+        # V2 Logic: For Salida (or others), inherit brand from material if not set
+        if data.get('tipo') == 'Salida' and not data.get('marca') and material.marca:
+            extra['marca'] = material.marca
+
+        movimiento = serializer.save(**extra)
 
         # V2 Logic: Update Material fields on Entry
-        if movimiento.tipo == 'Entrada':
-            # Update brand if provided
-            if movimiento.marca:
-                material.marca = movimiento.marca
-                should_save_material = True
+        if movimiento.tipo == 'Entrada' and movimiento.marca and material.marca_id != movimiento.marca_id:
+            material.marca = movimiento.marca
+            material.save(update_fields=['marca'])
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Creates a list of movements in one transaction. Stock is checked for the
+        whole batch at once (earlier lines count for later ones); if any line
+        fails nothing is saved and the errors are returned aligned with the input.
+        """
+        serializer = MovimientoBulkItemSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        movimientos = [Movimiento(usuario=request.user, **line) for line in serializer.validated_data]
+
+        with transaction.atomic():
+            shortages = check_batch_stock(movimientos)
+            if shortages:
+                errors = [{} for _ in movimientos]
+                for index, disponible in shortages.items():
+                    mov = movimientos[index]
+                    loc_name = mov.subbodega.nombre if mov.subbodega else "General"
+                    errors[index] = {
+                        api_settings.NON_FIELD_ERRORS_KEY: [
+                            f"Stock insuficiente en {mov.bodega.nombre} ({loc_name}). Disponible: {disponible} {mov.material.unidad}."
+                        ]
+                    }
+                return response.Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+            self._apply_marca_rules(movimientos)
+            Movimiento.objects.bulk_create(movimientos, batch_size=500)
+            # bulk_create skips the model signals
+            register_bulk_movements(movimientos)
+
+        return response.Response(
+            {'created': len(movimientos), 'ids': [mov.id for mov in movimientos]},
+            status=status.HTTP_201_CREATED
+        )
 
-        # V2 Logic: For Salida (or others), inherit brand from material if not set
-        elif movimiento.tipo == 'Salida':
-            if not movimiento.marca and material.marca:
-                movimiento.marca = material.marca
-                movimiento.save()
-        
-        if should_save_material:
-            material.save()
+    @action(detail=False, methods=['post'])
+    def disponibilidad(self, request):
+        """
+        Checks a picking list without writing anything: for each (material,
+        bodega, subbodega, cantidad) line, the stock available at that exact
+        location and the shortfall, with the rules used to validate a Salida.
+        """
+        serializer = DisponibilidadItemSerializer(data=request.data, many=True, allow_empty=False)
+        serializer.is_valid(raise_exception=True)
+        lineas = serializer.validated_data
+
+        resultado = check_availability([
+            (linea['material'].id, linea['bodega'].id, linea['subbodega'].id if linea.get('subbodega') else None, linea['cantidad'])
+            for linea in lineas
+        ])
+        items = []
+        for linea, (disponible, faltante) in zip(lineas, resultado):
+            material, bodega, subbodega = linea['material'], linea['bodega'], linea.get('subbodega')
+            items.append({
+                'material': material.id,
+                'codigo': material.codigo,
+                'nombre': material.nombre,
+                'bodega': bodega.id,
+                'subbodega': subbodega.id if subbodega else None,
+                'ubicacion': subbodega.display_path if subbodega else f"{bodega.nombre} - General",
+                'cantidad': linea['cantidad'],
+                'disponible': disponible,
+                'faltante': faltante,
+                'unidad': material.unidad,
+            })
+        return response.Response({'completo': not any(item['faltante'] for item in items), 'items': items})
+
+    def _apply_marca_rules(self, movimientos):
+        """Same brand rules as perform_create, applied in order over a batch."""
+        materiales_cambiados = {}
+        for mov in movimientos:
+            material = mov.material
+            if mov.tipo == 'Entrada' and mov.marca_id:
+                if material.marca_id != mov.marca_id:
+                    material.marca = mov.marca
+                    materiales_cambiados[material.id] = material
+            elif mov.tipo == 'Salida' and not mov.marca_id and material.marca_id:
+                mov.marca_id = material.marca_id
+        if materiales_cambiados:
+            Material.objects.bulk_update(materiales_cambiados.values(), ['marca'])
+            bump_catalog_versions('material')
+            codigos = [material.codigo_barras for material in materiales_cambiados.values()]
+            transaction.on_commit(lambda: invalidate_barcodes(*codigos))